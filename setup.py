@@ -8,5 +8,8 @@ setup(
     license='',
     author='christian-fr',
     author_email='',
-    description=''
+    description='',
+    extras_require={
+        'images': ['Pillow', 'pillow-heif'],
+    }
 )
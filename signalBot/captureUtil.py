@@ -0,0 +1,109 @@
+import atexit
+import base64
+import datetime
+import gzip
+import json
+import os
+import time
+import traceback
+from pathlib import Path
+from typing import Optional, Iterator, List, TextIO
+
+from signalBot.util import LOGGER, get_env_flag
+
+_CAPTURE_FILE: Optional[Path] = None
+_CAPTURE_HANDLE: Optional[TextIO] = None
+
+
+def capture_enabled() -> bool:
+    return os.getenv('CAPTURE_DIR') is not None and os.getenv('CAPTURE_DIR').strip() != ''
+
+
+def get_capture_file() -> Path:
+    global _CAPTURE_FILE
+    if _CAPTURE_FILE is None:
+        capture_dir = Path(os.getenv('CAPTURE_DIR'))
+        capture_dir.mkdir(parents=True, exist_ok=True)
+        _CAPTURE_FILE = Path(capture_dir,
+                             f'capture_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}_{os.getpid()}.ndjson.gz')
+        LOGGER.info(f'capturing traffic to {_CAPTURE_FILE.absolute()=}')
+    return _CAPTURE_FILE
+
+
+def get_capture_handle() -> TextIO:
+    """
+    one gzip stream per run, so the records share the compression dictionary
+    """
+    global _CAPTURE_HANDLE
+    if _CAPTURE_HANDLE is None:
+        _CAPTURE_HANDLE = gzip.open(get_capture_file(), 'at', encoding='utf-8')
+        atexit.register(close_capture)
+    return _CAPTURE_HANDLE
+
+
+def close_capture() -> None:
+    global _CAPTURE_HANDLE
+    if _CAPTURE_HANDLE is not None:
+        _CAPTURE_HANDLE.close()
+        _CAPTURE_HANDLE = None
+
+
+def write_capture_record(record: dict) -> None:
+    try:
+        record['ts'] = time.time()
+        capture_file = get_capture_handle()
+        capture_file.write(json.dumps(record) + '\n')
+        # sync flush, an interrupted run still leaves all records written so far readable
+        capture_file.flush()
+    except Exception:
+        LOGGER.error(traceback.format_exc())
+
+
+def attachment_ids_from_cli_response(response_bytes: bytes) -> List[str]:
+    attachment_ids = []
+    for line in response_bytes.decode('utf-8').split('\n'):
+        if line.strip() == '' or 'attachments' not in line:
+            continue
+        data_message = json.loads(line).get('envelope', {}).get('dataMessage') or {}
+        attachment_ids += [attachment['id'] for attachment in data_message.get('attachments', [])]
+    return attachment_ids
+
+
+def capture_signal_receive(response_bytes: bytes, returncode: int, duration: float) -> None:
+    if not capture_enabled():
+        return
+    # capturing is a side channel, the received messages must be forwarded even if it fails
+    try:
+        attachments = {}
+        if get_env_flag('CAPTURE_ATTACHMENTS'):
+            attachment_path = Path(os.getenv('SIGNAL_CONFIG'), "attachments")
+            for attachment_id in attachment_ids_from_cli_response(response_bytes):
+                attachment_file = Path(attachment_path, attachment_id)
+                if attachment_file.exists():
+                    attachments[attachment_id] = base64.b64encode(attachment_file.read_bytes()).decode('utf-8')
+        write_capture_record({'kind': 'signal_receive', 'duration': duration, 'returncode': returncode,
+                              'data': response_bytes.decode('utf-8'), 'attachments': attachments})
+    except Exception:
+        LOGGER.error(traceback.format_exc())
+
+
+def capture_imap_messages(mail_address: str, raw_mail_list: List[bytes], duration: float) -> None:
+    if not capture_enabled():
+        return
+    try:
+        for raw_mail in raw_mail_list:
+            write_capture_record({'kind': 'imap', 'duration': duration / len(raw_mail_list),
+                                  'mail_address': mail_address, 'data': base64.b64encode(raw_mail).decode('utf-8')})
+    except Exception:
+        LOGGER.error(traceback.format_exc())
+
+
+def read_capture_file(file_path: Path) -> Iterator[dict]:
+    with gzip.open(file_path, 'rt', encoding='utf-8') as capture_file:
+        try:
+            for line in capture_file:
+                if line.strip() != '':
+                    yield json.loads(line)
+        except EOFError:
+            # the capturing run was interrupted before the archive was closed
+            LOGGER.info(f'{file_path.absolute()=}: archive was not closed, read up to the last flushed record')
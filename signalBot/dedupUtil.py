@@ -0,0 +1,94 @@
+import hashlib
+import os
+import struct
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from signalBot.util import LOGGER, get_env_int
+
+ORIGIN_HEADER = 'X-SignalBot-Origin'
+
+DEFAULT_TTL_DAYS = 30
+
+# one record per key: 8 byte hash, 8 byte expiry (epoch seconds)
+RECORD = struct.Struct('<QQ')
+
+
+class SeenFilter:
+    """
+    persisted set of hashed keys (forwarded Message-IDs, signal (source, timestamp) pairs) with expiry
+    """
+
+    def __init__(self, file_path: Path, ttl_seconds: int, now: Optional[float] = None):
+        if now is None:
+            now = time.time()
+        self.file_path = file_path
+        self.ttl_seconds = ttl_seconds
+        self.entries: Dict[int, int] = {}
+        if file_path.exists():
+            data = file_path.read_bytes()
+            usable = len(data) - len(data) % RECORD.size
+            self.entries = {key_hash: expiry for key_hash, expiry in RECORD.iter_unpack(data[:usable])
+                            if expiry > now}
+
+    @staticmethod
+    def hash_key(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+    def __contains__(self, key: str) -> bool:
+        return self.hash_key(key) in self.entries
+
+    def add(self, key: str, now: Optional[float] = None) -> None:
+        if now is None:
+            now = time.time()
+        self.entries[self.hash_key(key)] = int(now + self.ttl_seconds)
+
+    def check_and_add(self, key: str, now: Optional[float] = None) -> bool:
+        """
+        returns True if the key has been seen before
+        """
+        if key in self:
+            return True
+        self.add(key, now)
+        return False
+
+    def save(self, now: Optional[float] = None) -> None:
+        if now is None:
+            now = time.time()
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = Path(self.file_path.parent, self.file_path.name + '.tmp')
+        tmp_path.write_bytes(b''.join([RECORD.pack(key_hash, expiry) for key_hash, expiry in self.entries.items()
+                                       if expiry > now]))
+        os.replace(tmp_path, self.file_path)
+
+
+_SEEN_FILTER_DICT: Dict[str, SeenFilter] = {}
+
+
+def get_seen_filter() -> SeenFilter:
+    file_path = Path(os.getenv('DEDUP_FILTER_PATH', './data/seen_filter.bin'))
+    key = str(file_path.absolute())
+    if key not in _SEEN_FILTER_DICT:
+        _SEEN_FILTER_DICT[key] = SeenFilter(file_path, get_env_int('DEDUP_TTL_DAYS', DEFAULT_TTL_DAYS) * 86400)
+        LOGGER.info(f'seen filter {file_path.absolute()=} loaded, {len(_SEEN_FILTER_DICT[key].entries)=}')
+    return _SEEN_FILTER_DICT[key]
+
+
+def save_seen_filter() -> None:
+    get_seen_filter().save()
+
+
+def get_origin_id() -> str:
+    origin_id = os.getenv('SIGNALBOT_ORIGIN_ID')
+    if origin_id is None:
+        origin_id = f"signalGroupBot {os.getenv('MAIL_USER')}"
+    return origin_id
+
+
+def mail_key(message_id: str) -> str:
+    return f'mail:{message_id.strip()}'
+
+
+def signal_key(source: str, timestamp: int) -> str:
+    return f'signal:{source}:{timestamp}'
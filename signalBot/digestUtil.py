@@ -0,0 +1,256 @@
+import hashlib
+import json
+import os
+import time
+import traceback
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple, Union
+
+from signalBot.mailUtil import send_mail
+from signalBot.util import LOGGER, get_env_flag, get_env_int, read_json_file, write_json_file, reformat_timestamp
+
+QUOTE_MARKER = '\n\n> [[ quote answer ]]'
+
+DEFAULT_DIGEST_INTERVAL = 3600
+DEFAULT_DIGEST_MAX_BYTES = 15_000_000
+
+
+def digest_mode_enabled() -> bool:
+    return get_env_flag('MAIL_DIGEST_MODE')
+
+
+def get_digest_spool_path() -> Path:
+    return Path(os.getenv('MAIL_DIGEST_SPOOL', './data/digest_spool.json'))
+
+
+def load_digest_spool(spool_path: Path) -> Dict[str, Union[None, float, list]]:
+    spool = read_json_file(spool_path, default=None)
+    if spool is None:
+        spool = {'window_start': None, 'messages': []}
+    # batches that are rendered, but not yet sent to every recipient
+    spool.setdefault('batches', [])
+    return spool
+
+
+def author_keys(uuid: Optional[str], number: Optional[str], timestamp: Optional[int]) -> List[Tuple[str, int]]:
+    return [(author, int(timestamp)) for author in [uuid, number] if author is not None and timestamp is not None]
+
+
+def message_keys(message: dict) -> List[Tuple[str, int]]:
+    return author_keys(message.get('sourceUuid'), message.get('sourceNumber'), message.get('timestamp'))
+
+
+def reaction_target_keys(message: dict) -> List[Tuple[str, int]]:
+    reaction = message['dataMessage']['reaction']
+    return author_keys(reaction.get('targetAuthorUuid'), reaction.get('targetAuthorNumber'),
+                       reaction.get('targetSentTimestamp'))
+
+
+def quote_target_keys(message: dict) -> List[Tuple[str, int]]:
+    quote = message['dataMessage']['quote']
+    return author_keys(quote.get('authorUuid'), quote.get('authorNumber'), quote.get('id'))
+
+
+def is_reaction(message: dict) -> bool:
+    return 'dataMessage' in message and 'reaction' in message['dataMessage']
+
+
+def is_quote(message: dict) -> bool:
+    return 'dataMessage' in message and 'quote' in message['dataMessage']
+
+
+def estimate_message_size(message: dict) -> int:
+    size = 0
+    if 'dataMessage' in message:
+        size += len((message['dataMessage'].get('message') or '').encode('utf-8'))
+        for attachment in message['dataMessage'].get('attachments', []):
+            if attachment.get('base64') is not None:
+                size += len(attachment['base64'])
+    return size
+
+
+def split_digest_batches(messages: List[dict], max_bytes: int) -> List[List[dict]]:
+    batches, batch, batch_size = [], [], 0
+    for message in messages:
+        message_size = estimate_message_size(message)
+        if batch and batch_size + message_size > max_bytes:
+            batches.append(batch)
+            batch, batch_size = [], 0
+        batch.append(message)
+        batch_size += message_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def thread_messages(messages: List[dict]) -> Tuple[List[dict], Dict[int, List[dict]], Dict[int, List[dict]]]:
+    """
+    returns the top level messages and, per message index, its folded reactions and its quote answers
+    """
+    key_index = {}
+    for i, message in enumerate(messages):
+        if not is_reaction(message):
+            for key in message_keys(message):
+                key_index[key] = i
+
+    top_level, reactions, replies = [], {}, {}
+    for i, message in enumerate(messages):
+        if is_reaction(message):
+            target = next((key_index[k] for k in reaction_target_keys(message) if k in key_index), None)
+            if target is not None:
+                reactions.setdefault(target, []).append(message)
+                continue
+        elif is_quote(message):
+            target = next((key_index[k] for k in quote_target_keys(message) if k in key_index), None)
+            if target is not None and target != i:
+                replies.setdefault(target, []).append(message)
+                continue
+        top_level.append(message)
+    return top_level, reactions, replies
+
+
+def render_reactions(reaction_list: List[dict]) -> Optional[str]:
+    current = {}
+    for reaction_msg in reaction_list:
+        reaction = reaction_msg['dataMessage']['reaction']
+        if reaction.get('isRemove'):
+            current.pop(reaction_msg['source'], None)
+        elif 'emoji' in reaction:
+            current[reaction_msg['source']] = reaction['emoji']
+    if not current:
+        return None
+    return 'Reaktionen: ' + ', '.join([f'{emoji} {source}' for source, emoji in current.items()])
+
+
+def render_attachments(message: dict, attachments: Dict[str, Tuple[str, str]]) -> List[str]:
+    lines = []
+    if 'dataMessage' not in message:
+        return lines
+    for signal_attachment in message['dataMessage'].get('attachments', []):
+        file_name = signal_attachment['filename']
+        if file_name is None:
+            file_name = signal_attachment['id']
+        base64_str = signal_attachment['base64']
+        if base64_str is None:
+            lines.append(f'[Anhang {file_name} größer als 10MB, wird nicht verschickt]')
+            continue
+        content_hash = hashlib.sha256(base64_str.encode('utf-8')).hexdigest()
+        if content_hash in attachments:
+            lines.append(f'[Anhang: {file_name} (identisch mit {attachments[content_hash][0]})]')
+        else:
+            attachments[content_hash] = (file_name, base64_str)
+            lines.append(f'[Anhang: {file_name}]')
+    return lines
+
+
+def render_message(message: dict, reactions: Dict[int, List[dict]], replies: Dict[int, List[dict]],
+                   index: Dict[int, int], attachments: Dict[str, Tuple[str, str]], depth: int = 0) -> List[str]:
+    indent = '    ' * depth
+    text = None
+    if 'dataMessage' in message:
+        text = message['dataMessage'].get('message')
+    if text is None:
+        text = '[kein Text]'
+    elif depth > 0 and QUOTE_MARKER in text:
+        # the quoted message is rendered right above, no need to repeat it
+        text = text.split(QUOTE_MARKER)[0]
+
+    lines = [f"{indent}[{reformat_timestamp(int(message['timestamp']))}] {message['source']}:"]
+    lines += [f'{indent}{li}' for li in text.split('\n')]
+    lines += [f'{indent}{li}' for li in render_attachments(message, attachments)]
+
+    i = index[id(message)]
+    reaction_line = render_reactions(reactions.get(i, []))
+    if reaction_line is not None:
+        lines.append(f'{indent}{reaction_line}')
+    for reply in replies.get(i, []):
+        lines.append('')
+        lines += render_message(reply, reactions, replies, index, attachments, depth + 1)
+    return lines
+
+
+def render_digest(messages: List[dict]) -> Tuple[str, str, List[Tuple[str, str]]]:
+    messages = sorted(messages, key=lambda x: x['timestamp'])
+    top_level, reactions, replies = thread_messages(messages)
+    index = {id(message): i for i, message in enumerate(messages)}
+    attachments = {}
+
+    first_str = messages[0]['timestamp_str']
+    last_str = messages[-1]['timestamp_str']
+    subject = f"drahtesel*innen / Zusammenfassung {first_str} - {last_str} / {len(messages)} Nachrichten"
+    body_lines = [f"Date: {reformat_timestamp(int(messages[0]['timestamp']))} - "
+                  f"{reformat_timestamp(int(messages[-1]['timestamp']))}",
+                  f"Messages: {len(messages)}",
+                  f"To: drahtesel*innen signal chat",
+                  '',
+                  '====================']
+    for message in top_level:
+        body_lines.append('')
+        body_lines += render_message(message, reactions, replies, index, attachments)
+        body_lines.append('')
+        body_lines.append('====================')
+    return subject, '\n'.join(body_lines) + '\n', list(attachments.values())
+
+
+def digest_is_due(spool: dict, now: float, interval: int, max_bytes: int) -> bool:
+    if spool['batches']:
+        return True
+    if not spool['messages']:
+        return False
+    if spool['window_start'] is not None and now - spool['window_start'] >= interval:
+        return True
+    return sum([estimate_message_size(m) for m in spool['messages']]) >= max_bytes
+
+
+def send_digest(batch: dict) -> int:
+    """
+    sends one digest batch to its remaining recipients; every recipient that got the mail is removed from the batch
+    """
+    subject, body, attachments = render_digest(batch['messages'])
+    done = 0
+    for mail_address in list(batch['recipients']):
+        try:
+            rc = send_mail(mail_address, body, subject, attachments)
+        except Exception:
+            LOGGER.error(traceback.format_exc())
+            continue
+        if rc:
+            batch['recipients'].remove(mail_address)
+            done += 1
+    return done
+
+
+def flush_digest(spool: dict, max_bytes: int) -> int:
+    recipients = json.loads(os.getenv('MAIL_ADDRESS_LIST_FORWARD_TO'))
+    spool['batches'] += [{'messages': batch, 'recipients': list(recipients)} for batch in
+                         split_digest_batches(sorted(spool['messages'], key=lambda x: x['timestamp']), max_bytes)]
+    spool['messages'] = []
+    spool['window_start'] = None
+
+    done = 0
+    for batch in spool['batches']:
+        done += send_digest(batch)
+    # batches with recipients left stay in the spool and are retried for these recipients only
+    spool['batches'] = [batch for batch in spool['batches'] if batch['recipients']]
+    return done
+
+
+def process_signal_msgs_to_digest(messages: List[dict], now: Optional[float] = None) -> int:
+    if now is None:
+        now = time.time()
+    interval = get_env_int('MAIL_DIGEST_INTERVAL', DEFAULT_DIGEST_INTERVAL)
+    max_bytes = get_env_int('MAIL_DIGEST_MAX_BYTES', DEFAULT_DIGEST_MAX_BYTES)
+    spool_path = get_digest_spool_path()
+
+    spool = load_digest_spool(spool_path)
+    if messages and spool['window_start'] is None:
+        spool['window_start'] = now
+    spool['messages'] += messages
+    write_json_file(spool_path, spool)
+
+    done = 0
+    if digest_is_due(spool, now, interval, max_bytes):
+        LOGGER.info(f"flushing digest: {len(spool['messages'])=}, {len(spool['batches'])=}")
+        done = flush_digest(spool, max_bytes)
+        write_json_file(spool_path, spool)
+    return done
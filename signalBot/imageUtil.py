@@ -0,0 +1,247 @@
+import datetime
+import hashlib
+import io
+import math
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from importlib.util import find_spec
+from pathlib import Path
+from typing import List, Optional, Tuple, Dict, Union
+
+from signalBot.util import LOGGER, get_env_flag, get_env_int
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.heic', '.heif']
+IMAGE_CONTENT_TYPES = ['image/jpeg', 'image/jpg', 'image/png', 'image/heic', 'image/heif']
+CONTENT_TYPE_DICT = {'jpg': 'image/jpeg', 'png': 'image/png'}
+
+DEFAULT_MAX_BYTES = 1_000_000
+DEFAULT_MAX_PIXELS = 4_000_000
+DEFAULT_QUALITY = 80
+DEFAULT_CACHE_MAX_AGE_DAYS = 5
+
+
+@dataclass
+class TranscodeReport:
+    files: int = 0
+    transcoded: int = 0
+    cache_hits: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.bytes_in - self.bytes_out
+
+    def add(self, other: 'TranscodeReport') -> None:
+        self.files += other.files
+        self.transcoded += other.transcoded
+        self.cache_hits += other.cache_hits
+        self.bytes_in += other.bytes_in
+        self.bytes_out += other.bytes_out
+
+    def __str__(self):
+        return f'{self.files} images, {self.transcoded} transcoded, {self.cache_hits} from cache, ' \
+               f'{self.bytes_in} -> {self.bytes_out} bytes ({self.bytes_saved} bytes saved)'
+
+
+RUN_REPORT = TranscodeReport()
+
+
+def image_transcode_enabled() -> bool:
+    return get_env_flag('IMAGE_TRANSCODE')
+
+
+def pil_available() -> bool:
+    return find_spec('PIL') is not None
+
+
+def is_image(file_name: Optional[str], content_type: Optional[str] = None) -> bool:
+    if content_type is not None:
+        return content_type.lower() in IMAGE_CONTENT_TYPES
+    return file_name is not None and Path(file_name).suffix.lower() in IMAGE_EXTENSIONS
+
+
+def replace_extension(file_name: str, ext: str) -> str:
+    return str(Path(file_name).with_suffix(f'.{ext}'))
+
+
+def get_transcode_cache_path() -> Path:
+    return Path(os.getenv('IMAGE_TRANSCODE_CACHE', './data/transcode_cache'))
+
+
+def transcode_image(data: bytes, max_bytes: int, max_pixels: int, quality: int) -> Optional[Tuple[bytes, str]]:
+    """
+    downscales and re-encodes a single image; returns the new data and file extension, or None if the image is
+    already small enough or could not be made smaller. runs in a worker process.
+    """
+    from PIL import Image, ImageOps
+    try:
+        from pillow_heif import register_heif_opener
+        register_heif_opener()
+    except ImportError:
+        pass
+
+    with Image.open(io.BytesIO(data)) as img:
+        img_format = img.format
+        pixels = img.width * img.height
+        if len(data) <= max_bytes and pixels <= max_pixels:
+            return None
+        img = ImageOps.exif_transpose(img)
+        if pixels > max_pixels:
+            scale = math.sqrt(max_pixels / pixels)
+            img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))), Image.LANCZOS)
+        out = io.BytesIO()
+        if img_format == 'PNG':
+            img.save(out, format='PNG', optimize=True)
+            ext = 'png'
+        else:
+            img.convert('RGB').save(out, format='JPEG', quality=quality, optimize=True, progressive=True)
+            ext = 'jpg'
+    if out.tell() >= len(data):
+        return None
+    return out.getvalue(), ext
+
+
+def read_source(source: Union[bytes, Path]) -> bytes:
+    return source.read_bytes() if isinstance(source, Path) else source
+
+
+def source_size(source: Union[bytes, Path]) -> int:
+    return source.stat().st_size if isinstance(source, Path) else len(source)
+
+
+def cache_key(source: Union[bytes, Path], max_bytes: int, max_pixels: int, quality: int) -> str:
+    if isinstance(source, Path):
+        content_hash = hashlib.sha256()
+        with open(source, 'rb') as source_file:
+            for block in iter(lambda: source_file.read(1 << 20), b''):
+                content_hash.update(block)
+    else:
+        content_hash = hashlib.sha256(source)
+    content_hash.update(f'{max_bytes}/{max_pixels}/{quality}'.encode('utf-8'))
+    return content_hash.hexdigest()
+
+
+def read_cache(cache_path: Path, key: str) -> Tuple[bool, Optional[Tuple[bytes, str]]]:
+    if Path(cache_path, f'{key}.skip').exists():
+        return True, None
+    for ext in CONTENT_TYPE_DICT.keys():
+        cache_file = Path(cache_path, f'{key}.{ext}')
+        if cache_file.exists():
+            return True, (cache_file.read_bytes(), ext)
+    return False, None
+
+
+def write_cache(cache_path: Path, key: str, result: Optional[Tuple[bytes, str]]) -> None:
+    cache_path.mkdir(parents=True, exist_ok=True)
+    if result is None:
+        Path(cache_path, f'{key}.skip').touch()
+    else:
+        Path(cache_path, f'{key}.{result[1]}').write_bytes(result[0])
+
+
+def transcode_images(source_list: List[Union[bytes, Path]]) -> List[Optional[Tuple[bytes, str]]]:
+    """
+    transcodes a batch of images (file paths or data) in a process pool; every distinct image is only processed once,
+    results are cached by content hash. files are only read by the worker that transcodes them.
+    """
+    max_bytes = get_env_int('IMAGE_TRANSCODE_MAX_BYTES', DEFAULT_MAX_BYTES)
+    max_pixels = get_env_int('IMAGE_TRANSCODE_MAX_PIXELS', DEFAULT_MAX_PIXELS)
+    quality = get_env_int('IMAGE_TRANSCODE_QUALITY', DEFAULT_QUALITY)
+    workers = get_env_int('IMAGE_TRANSCODE_WORKERS', 0)
+    cache_path = get_transcode_cache_path()
+    report = TranscodeReport()
+
+    keys = [cache_key(source, max_bytes, max_pixels, quality) for source in source_list]
+    results: Dict[str, Optional[Tuple[bytes, str]]] = {}
+    todo: Dict[str, Union[bytes, Path]] = {}
+    for key, source in zip(keys, source_list):
+        if key in results or key in todo:
+            continue
+        found, result = read_cache(cache_path, key)
+        if found:
+            results[key] = result
+            report.cache_hits += 1
+        else:
+            todo[key] = source
+
+    if todo:
+        if len(todo) == 1 or workers == 1:
+            # not worth starting a pool
+            transcoded = {key: _run_transcode(source, max_bytes, max_pixels, quality) for key, source in
+                          todo.items()}
+        else:
+            with ProcessPoolExecutor(max_workers=workers if workers > 0 else None) as executor:
+                futures = {key: executor.submit(_run_transcode, source, max_bytes, max_pixels, quality)
+                           for key, source in todo.items()}
+                transcoded = {key: future.result() for key, future in futures.items()}
+        for key, (success, result) in transcoded.items():
+            # failures are not cached, a later run (e.g. with pillow-heif installed) may succeed
+            if success:
+                write_cache(cache_path, key, result)
+            results[key] = result
+
+    output = [results[key] for key in keys]
+    for source, result in zip(source_list, output):
+        report.files += 1
+        report.bytes_in += source_size(source)
+        if result is None:
+            report.bytes_out += source_size(source)
+        else:
+            report.transcoded += 1
+            report.bytes_out += len(result[0])
+    RUN_REPORT.add(report)
+    LOGGER.info(f'image transcoding: {report}')
+    return output
+
+
+def _run_transcode(source: Union[bytes, Path], max_bytes: int, max_pixels: int, quality: int) -> \
+        Tuple[bool, Optional[Tuple[bytes, str]]]:
+    try:
+        return True, transcode_image(read_source(source), max_bytes, max_pixels, quality)
+    except Exception:
+        LOGGER.error(f'image transcoding failed: {traceback.format_exc()}')
+        return False, None
+
+
+def transcode_attachment_files(attachment_list: List[Tuple[str, Path]]) -> Dict[str, Tuple[bytes, str]]:
+    """
+    transcodes signal attachment files, returns the results per attachment id
+    """
+    if not attachment_list or not image_transcode_enabled():
+        return {}
+    if not pil_available():
+        LOGGER.error('IMAGE_TRANSCODE is set, but Pillow is not installed')
+        return {}
+    ids = [attachment_id for attachment_id, _ in attachment_list]
+    output = transcode_images([file_path for _, file_path in attachment_list])
+    return {attachment_id: result for attachment_id, result in zip(ids, output) if result is not None}
+
+
+def transcode_mail_attachments(attachments_list: Optional[List[Tuple[str, bytes]]]) -> \
+        Optional[List[Tuple[str, bytes]]]:
+    if not attachments_list or not image_transcode_enabled():
+        return attachments_list
+    if not pil_available():
+        LOGGER.error('IMAGE_TRANSCODE is set, but Pillow is not installed')
+        return attachments_list
+    image_index = [i for i, (file_name, _) in enumerate(attachments_list) if is_image(file_name)]
+    output = transcode_images([attachments_list[i][1] for i in image_index])
+    attachments_list = list(attachments_list)
+    for i, result in zip(image_index, output):
+        if result is not None:
+            attachments_list[i] = (replace_extension(attachments_list[i][0], result[1]), result[0])
+    return attachments_list
+
+
+def cleanup_transcode_cache(max_age_days: int = DEFAULT_CACHE_MAX_AGE_DAYS) -> None:
+    cache_path = get_transcode_cache_path()
+    if not cache_path.exists():
+        return
+    for f in cache_path.iterdir():
+        mtime_diff = datetime.datetime.now() - datetime.datetime.fromtimestamp(os.stat(f).st_mtime)
+        if mtime_diff.days >= max_age_days:
+            f.unlink(missing_ok=True)
+            LOGGER.info(f"removed file: {f.absolute()}")
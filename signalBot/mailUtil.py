@@ -2,13 +2,16 @@ import datetime
 import email
 import logging
 import os
+import re
+import time
 import traceback
 from collections import defaultdict
 from email import message
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from email.utils import formatdate
+from email.parser import BytesHeaderParser
+from email.utils import formatdate, make_msgid
 from imaplib import IMAP4_SSL
 from mimetypes import guess_type
 from pathlib import Path
@@ -17,6 +20,8 @@ from typing import List, Optional, Tuple, Dict
 
 from dotenv import load_dotenv
 
+from signalBot.captureUtil import capture_imap_messages
+from signalBot.dedupUtil import ORIGIN_HEADER, get_seen_filter, save_seen_filter, get_origin_id, mail_key
 from signalBot.util import startup_logger, Email
 
 load_dotenv()
@@ -30,7 +35,7 @@ def process_content(part: email.message.Message, file_name: Optional[str]) -> Tu
     attachments_list = []
     content_type = part.get_content_type()
     raw_types = ["application/vnd.openxmlformats-officedocument.wordprocessingml.document", "image/gif",
-                 "image/jpeg", "image/jpg", "image/png", "application/pdf",
+                 "image/jpeg", "image/jpg", "image/png", "image/heic", "image/heif", "application/pdf",
                  "application/vnd.oasis.opendocument.text"]
     text_types = ["text/plain", "text/markdown"]
     ignore_types = ["text/html"]
@@ -84,6 +89,50 @@ def get_unread_mail_uids(imap_ssl: IMAP4_SSL, mail_address_list: List[str], mail
     return found_mail_uid
 
 
+def parse_header_fetch(data: list) -> Dict[bytes, email.message.Message]:
+    header_dict = {}
+    for i, item in enumerate(data):
+        if not isinstance(item, tuple):
+            continue
+        uid_match = re.search(rb'UID (\d+)', item[0])
+        if uid_match is None and i + 1 < len(data) and isinstance(data[i + 1], bytes):
+            # some servers send the UID after the literal
+            uid_match = re.search(rb'UID (\d+)', data[i + 1])
+        if uid_match is not None:
+            header_dict[uid_match.group(1)] = BytesHeaderParser().parsebytes(item[1])
+    return header_dict
+
+
+def filter_mail_uids(imap_ssl: IMAP4_SSL, mail_uid_dict: Dict[str, List[bytes]]) -> Dict[str, List[bytes]]:
+    """
+    drops mails sent by this bot and mails that have already been forwarded, based on their headers only
+    """
+    seen_filter = get_seen_filter()
+    origin_id = get_origin_id()
+    filtered_uid_dict = {}
+    for mail_address, mail_uid_list in mail_uid_dict.items():
+        typ, data = imap_ssl.uid('fetch', b','.join(mail_uid_list),
+                                 f'(BODY.PEEK[HEADER.FIELDS (MESSAGE-ID {ORIGIN_HEADER.upper()})])')
+        header_dict = parse_header_fetch(data) if typ == 'OK' else {}
+        keep_list, drop_list = [], []
+        for uid in mail_uid_list:
+            header = header_dict.get(uid)
+            if header is not None and header[ORIGIN_HEADER] == origin_id:
+                LOGGER.info(f'dropping mail {uid=} from {mail_address=}: sent by this bot')
+                drop_list.append(uid)
+            elif header is not None and header['Message-ID'] is not None and \
+                    seen_filter.check_and_add(mail_key(header['Message-ID'])):
+                LOGGER.info(f'dropping mail {uid=} from {mail_address=}: already forwarded')
+                drop_list.append(uid)
+            else:
+                keep_list.append(uid)
+        if drop_list:
+            imap_ssl.uid('store', b','.join(drop_list), '+FLAGS', '(\\Seen)')
+        if keep_list:
+            filtered_uid_dict[mail_address] = keep_list
+    return filtered_uid_dict
+
+
 def get_mail_per_uid(imap_ssl: IMAP4_SSL, mail_uid_dict: Dict[str, List[bytes]]) -> Dict[str, List[bytes]]:
     mail_raw_dict = defaultdict(list)
     for mail_address, mail_uid_list in mail_uid_dict.items():
@@ -151,8 +200,13 @@ def get_new_mail(mail_address_list: List[str], dump_raw_mails: bool = False) ->
     with IMAP4_SSL(host=host, port=port) as M:
         try:
             address_uid_dict = get_unread_mail_uids(M, mail_address_list, mailbox)
+            address_uid_dict = filter_mail_uids(M, address_uid_dict)
+            start = time.monotonic()
             raw_mails_dict = get_mail_per_uid(M, address_uid_dict)
+            duration = time.monotonic() - start
             for sender, msg_list in raw_mails_dict.items():
+                capture_imap_messages(sender, [msg[0][1] for msg in msg_list],
+                                      duration * len(msg_list) / sum([len(v) for v in raw_mails_dict.values()]))
                 if dump_raw_mails:
                     base_path = Path('./tests/context')
                     base_path.mkdir(exist_ok=True, parents=True)
@@ -161,12 +215,17 @@ def get_new_mail(mail_address_list: List[str], dump_raw_mails: bool = False) ->
                 [results_list.append(process_message(email.message_from_bytes(msg[0][1]))) for msg in msg_list]
         except Exception as err:
             LOGGER.error(traceback.print_exc())
+        finally:
+            save_seen_filter()
     return results_list
 
 
-def send_mail(to_address: str, body: str, subject: str, attachments: Optional[List[Tuple[str, str]]] = None) -> bool:
+def send_mail(to_address: str, body: str, subject: str, attachments: Optional[List[Tuple[str, str]]] = None,
+              headers: Optional[Dict[str, str]] = None) -> bool:
     if attachments is None:
         attachments = []
+    if headers is None:
+        headers = {}
 
     msg = MIMEMultipart()
     user = os.getenv('MAIL_USER')
@@ -174,6 +233,13 @@ def send_mail(to_address: str, body: str, subject: str, attachments: Optional[Li
     msg['To'] = to_address
     msg['Date'] = formatdate(localtime=True)
     msg['Subject'] = subject
+    msg[ORIGIN_HEADER] = get_origin_id()
+    for header_name, header_value in headers.items():
+        msg[header_name] = header_value
+    if msg['Message-ID'] is None:
+        msg['Message-ID'] = make_msgid(idstring='signalBot', domain=user.split('@')[-1] if user else None)
+    # the forwarded mail must not come back in via a forward-from list
+    get_seen_filter().add(mail_key(msg['Message-ID']))
 
     msg.attach(MIMEText(body))
 
@@ -3,8 +3,12 @@ import logging
 import os
 import traceback
 from dotenv import load_dotenv
+from signalBot.dedupUtil import save_seen_filter
+from signalBot.digestUtil import digest_mode_enabled
+from signalBot.imageUtil import image_transcode_enabled, cleanup_transcode_cache, RUN_REPORT
 from signalBot.mailUtil import get_new_mail
-from signalBot.signalBot import run_signal_bot_receive, process_signal_msgs_to_mail, process_mail_to_signal_msg
+from signalBot.signalBot import run_signal_bot_receive, process_signal_msgs_to_mail, process_mail_to_signal_msg, \
+    backlog_mode_enabled, run_signal_bot_receive_backlog
 from signalBot.util import cleanup_attachments, startup_logger, LOGGER
 
 load_dotenv()
@@ -13,17 +17,29 @@ startup_logger(LOGGER, log_level=logging.DEBUG)
 
 if __name__ == '__main__':
     cleanup_attachments()
-    msgs = run_signal_bot_receive()
-    sent_mails = process_signal_msgs_to_mail(msgs)
-    try:
-        LOGGER.info(
-            f'{sent_mails=}, {len(msgs.values())=}, {len(json.loads(os.getenv("MAIL_ADDRESS_LIST_FORWARD_TO")))=}')
-        assert sent_mails == len(json.loads(os.getenv("MAIL_ADDRESS_LIST_FORWARD_TO"))) * len(msgs.values())
-    except AssertionError as err:
-        LOGGER.error(traceback.format_exc())
+    cleanup_transcode_cache()
+    if backlog_mode_enabled():
+        received_msgs, sent_mails = run_signal_bot_receive_backlog()
+        LOGGER.info(f'{received_msgs=}, {sent_mails=}')
+    else:
+        msgs = run_signal_bot_receive()
+        sent_mails = process_signal_msgs_to_mail(msgs)
+        save_seen_filter()
+        try:
+            forward_to = json.loads(os.getenv("MAIL_ADDRESS_LIST_FORWARD_TO"))
+            LOGGER.info(f'{sent_mails=}, {len(msgs.values())=}, {len(forward_to)=}')
+            # in digest mode mails are sent per time window, not per message
+            assert digest_mode_enabled() or sent_mails == len(forward_to) * len(msgs.values())
+        except AssertionError as err:
+            LOGGER.error(traceback.format_exc())
 
     try:
         new_mails = get_new_mail(json.loads(os.getenv('MAIL_ADDRESS_LIST_FORWARD_FROM')))
         [process_mail_to_signal_msg(new_mail) for new_mail in new_mails]
     except Exception:
         LOGGER.error(traceback.format_exc())
+    finally:
+        save_seen_filter()
+
+    if image_transcode_enabled():
+        LOGGER.info(f'image transcoding: {RUN_REPORT}')
@@ -0,0 +1,120 @@
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Dict, Tuple
+
+from signalBot.util import LOGGER, get_env_int
+
+SNIPPET_LENGTH = 100
+
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_RETENTION_DAYS = 30
+
+
+@dataclass
+class IndexEntry:
+    snippet: str
+    message_id: Optional[str]
+
+
+class MessageIndex:
+    """
+    on-disk index of forwarded messages, keyed by (author, sent timestamp), with an in-memory LRU cache in front
+    """
+
+    def __init__(self, db_path: Path, cache_size: int = DEFAULT_CACHE_SIZE):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._con = sqlite3.connect(db_path)
+        self._con.execute('CREATE TABLE IF NOT EXISTS messages ('
+                          'author TEXT NOT NULL, '
+                          'sent_timestamp INTEGER NOT NULL, '
+                          'snippet TEXT NOT NULL, '
+                          'message_id TEXT, '
+                          'indexed_at REAL NOT NULL, '
+                          'PRIMARY KEY (author, sent_timestamp)) WITHOUT ROWID')
+        self._con.commit()
+
+    def _cache_put(self, key: Tuple[str, int], entry: Optional[IndexEntry]) -> None:
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def add(self, authors: List[Optional[str]], sent_timestamp: int, snippet: str, message_id: Optional[str],
+            now: Optional[float] = None) -> None:
+        """
+        inserts without committing, call commit() once per batch
+        """
+        if now is None:
+            now = time.time()
+        entry = IndexEntry(snippet, message_id)
+        rows = [(author, int(sent_timestamp), snippet, message_id, now) for author in authors if author is not None]
+        self._con.executemany('INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?)', rows)
+        for author, ts, _, _, _ in rows:
+            self._cache_put((author, ts), entry)
+
+    def commit(self) -> None:
+        self._con.commit()
+
+    def lookup(self, authors: List[Optional[str]], sent_timestamp: int) -> Optional[IndexEntry]:
+        for author in authors:
+            if author is None:
+                continue
+            key = (author, int(sent_timestamp))
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                entry = self._cache[key]
+            else:
+                row = self._con.execute('SELECT snippet, message_id FROM messages '
+                                        'WHERE author = ? AND sent_timestamp = ?', key).fetchone()
+                entry = IndexEntry(*row) if row is not None else None
+                self._cache_put(key, entry)
+            if entry is not None:
+                return entry
+        return None
+
+    def compact(self, max_age_seconds: float, now: Optional[float] = None) -> int:
+        if now is None:
+            now = time.time()
+        removed = self._con.execute('DELETE FROM messages WHERE indexed_at < ?', (now - max_age_seconds,)).rowcount
+        self._con.commit()
+        if removed > 0:
+            self._con.execute('VACUUM')
+            self._cache.clear()
+        return removed
+
+    def close(self) -> None:
+        self._con.close()
+
+
+_MESSAGE_INDEX_DICT: Dict[str, MessageIndex] = {}
+
+
+def get_message_index_path() -> Path:
+    return Path(os.getenv('MESSAGE_INDEX_PATH', './data/message_index.sqlite3'))
+
+
+def get_message_index() -> MessageIndex:
+    db_path = get_message_index_path()
+    key = str(db_path.absolute())
+    if key not in _MESSAGE_INDEX_DICT:
+        index = MessageIndex(db_path, cache_size=get_env_int('MESSAGE_INDEX_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+        removed = index.compact(get_env_int('MESSAGE_INDEX_RETENTION_DAYS', DEFAULT_RETENTION_DAYS) * 86400)
+        LOGGER.info(f'message index {db_path.absolute()=} opened, {removed=}')
+        _MESSAGE_INDEX_DICT[key] = index
+    return _MESSAGE_INDEX_DICT[key]
+
+
+def make_snippet(text: Optional[str], length: int = SNIPPET_LENGTH) -> str:
+    if text is None:
+        return ''
+    text = ' '.join(text.split())
+    if len(text) > length:
+        text = text[:length - 1] + '…'
+    return text
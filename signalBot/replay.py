@@ -0,0 +1,133 @@
+"""
+replays a capture archive (see captureUtil) through the processing pipeline with stubbed transports:
+
+    python -m signalBot.replay ./capture/capture_20240101_120000_1234.ndjson.gz [--rate recorded] [--speed 10]
+"""
+import argparse
+import base64
+import email
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Iterator
+from unittest.mock import patch
+
+from signalBot.captureUtil import read_capture_file, attachment_ids_from_cli_response
+from signalBot.util import LOGGER
+
+
+@dataclass
+class ReplayStats:
+    records: Dict[str, int] = field(default_factory=dict)
+    seconds: Dict[str, float] = field(default_factory=dict)
+    mails_sent: int = 0
+    mail_bytes: int = 0
+    signal_sends: int = 0
+    wall_seconds: float = 0.0
+
+    def add(self, kind: str, seconds: float) -> None:
+        self.records[kind] = self.records.get(kind, 0) + 1
+        self.seconds[kind] = self.seconds.get(kind, 0.0) + seconds
+
+    def __str__(self):
+        lines = [f'wall time: {self.wall_seconds:.3f}s']
+        for kind, count in self.records.items():
+            lines.append(f'{kind}: {count} records, {self.seconds[kind]:.3f}s processing, '
+                         f'{1000 * self.seconds[kind] / count:.2f}ms per record')
+        lines.append(f'mails sent: {self.mails_sent} ({self.mail_bytes} bytes), signal sends: {self.signal_sends}')
+        return '\n'.join(lines)
+
+
+@contextmanager
+def stubbed_transports(work_dir: Path) -> Iterator[ReplayStats]:
+    """
+    replaces SMTP and signal-cli by counting stubs and points all state files into work_dir
+    """
+    stats = ReplayStats()
+
+    def smtp_ssl_send_stub(msg, to_address):
+        stats.mails_sent += 1
+        stats.mail_bytes += len(msg.as_bytes())
+
+    def send_message_stub(cmd, *args, **kwargs):
+        stats.signal_sends += 1
+
+    env = {'SIGNAL_CONFIG': str(Path(work_dir, 'signal')),
+           'MESSAGE_INDEX_PATH': str(Path(work_dir, 'message_index.sqlite3')),
+           'DEDUP_FILTER_PATH': str(Path(work_dir, 'seen_filter.bin')),
+           'MAIL_DIGEST_SPOOL': str(Path(work_dir, 'digest_spool.json')),
+           'SIGNAL_RECEIVE_CHECKPOINT': str(Path(work_dir, 'receive_checkpoint.json')),
+           'IMAGE_TRANSCODE_CACHE': str(Path(work_dir, 'transcode_cache')),
+           'CAPTURE_DIR': '',
+           'ENCRYPTION_KEY': os.getenv('ENCRYPTION_KEY', 'replay'),
+           'MAIL_ADDRESS_LIST_FORWARD_TO': os.getenv('MAIL_ADDRESS_LIST_FORWARD_TO', '["replay@example.com"]'),
+           'MAIL_ADMIN_ADDRESS': os.getenv('MAIL_ADMIN_ADDRESS', '["replay@example.com"]'),
+           'SIGNAL_ADDRESS_DICT': os.getenv('SIGNAL_ADDRESS_DICT', '[]')}
+    Path(work_dir, 'signal', 'attachments').mkdir(parents=True, exist_ok=True)
+    with patch.dict(os.environ, env):
+        # signalBot.signalBot needs ENCRYPTION_KEY at import time
+        import signalBot.signalBot
+        with patch('signalBot.mailUtil.smtp_ssl_send', smtp_ssl_send_stub), \
+                patch('signalBot.signalBot.send_message', send_message_stub):
+            yield stats
+
+
+def write_attachments(record: dict, work_dir: Path) -> None:
+    attachment_path = Path(work_dir, 'signal', 'attachments')
+    for attachment_id in attachment_ids_from_cli_response(record['data'].encode('utf-8')):
+        attachment_file = Path(attachment_path, attachment_id)
+        if attachment_id in record.get('attachments', {}):
+            attachment_file.write_bytes(base64.b64decode(record['attachments'][attachment_id]))
+        elif not attachment_file.exists():
+            # attachment was not captured, replay with an empty placeholder
+            attachment_file.touch()
+
+
+def replay_record(record: dict, work_dir: Path) -> None:
+    from signalBot.mailUtil import process_message
+    from signalBot.signalBot import process_cli_response, process_signal_msgs_to_mail, process_mail_to_signal_msg
+    if record['kind'] == 'signal_receive':
+        write_attachments(record, work_dir)
+        msgs = dict(process_cli_response(record['data'].encode('utf-8')))
+        process_signal_msgs_to_mail(msgs)
+    elif record['kind'] == 'imap':
+        mail = process_message(email.message_from_bytes(base64.b64decode(record['data'])))
+        process_mail_to_signal_msg(mail)
+    else:
+        LOGGER.error(f"unknown capture record kind: {record['kind']}")
+
+
+def replay(records: List[dict], rate: str = 'max', speed: float = 1.0) -> ReplayStats:
+    with tempfile.TemporaryDirectory() as tmp_dir, stubbed_transports(Path(tmp_dir)) as stats:
+        wall_start = time.perf_counter()
+        first_ts = records[0]['ts'] if records else 0.0
+        for record in records:
+            if rate == 'recorded':
+                delay = wall_start + (record['ts'] - first_ts) / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            start = time.perf_counter()
+            replay_record(record, Path(tmp_dir))
+            stats.add(record['kind'], time.perf_counter() - start)
+        stats.wall_seconds = time.perf_counter() - wall_start
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='replay a capture archive with stubbed transports')
+    parser.add_argument('archive', type=Path, nargs='+')
+    parser.add_argument('--rate', choices=['max', 'recorded'], default='max')
+    parser.add_argument('--speed', type=float, default=1.0, help='speed factor for --rate recorded')
+    args = parser.parse_args(argv)
+
+    records = [record for archive in args.archive for record in read_capture_file(archive)]
+    records.sort(key=lambda r: r['ts'])
+    stats = replay(records, rate=args.rate, speed=args.speed)
+    print(stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,51 @@
 import base64
 import json
 import os
+import time
 import traceback
 from collections import defaultdict
+from email.utils import make_msgid
+from functools import lru_cache
 from pathlib import Path
 from tempfile import mkdtemp
-from typing import List, Dict, Union, Optional, Tuple
+from typing import List, Dict, Union, Optional, Tuple, Any, Callable
+from signalBot.captureUtil import capture_signal_receive
+from signalBot.dedupUtil import get_seen_filter, save_seen_filter, signal_key
+from signalBot.digestUtil import digest_mode_enabled, process_signal_msgs_to_digest
+from signalBot.imageUtil import image_transcode_enabled, is_image, transcode_attachment_files, \
+    transcode_mail_attachments, replace_extension, CONTENT_TYPE_DICT
 from signalBot.mailUtil import send_mail
+from signalBot.messageIndex import get_message_index, get_message_index_path, make_snippet, IndexEntry
 from signalBot.util import Email, convert_epoch_timestamp_into_str, \
     run_signal_cli_command, send_message, reformat_timestamp, cmd_send_to_user_number, cmd_add_attachment, \
-    cmd_send_to_group, LOGGER, flatten
+    cmd_send_to_group, LOGGER, flatten, get_env_flag, get_env_int, read_json_file, write_json_file, \
+    message_from_stdin_enabled, split_message_text
 
 ENCRYPTION_KEY = os.getenv('ENCRYPTION_KEY')
 assert ENCRYPTION_KEY is not None
 
+DEFAULT_RECEIVE_MAX_MESSAGES = 100
+DEFAULT_RECEIVE_TIMEOUT = 5
+DEFAULT_RECEIVE_TIME_BUDGET = 600
+DEFAULT_MESSAGE_MAX_LENGTH = 16000
+
 
 def add_timestamp_str(msg_dict_envelope: dict) -> dict:
     msg_dict_envelope['timestamp_str'] = convert_epoch_timestamp_into_str(msg_dict_envelope['timestamp'])
     return msg_dict_envelope
 
 
-def get_sender_from_uuid(sender_uuid: str) -> Optional[str]:
-    address_dict = json.loads(os.getenv('SIGNAL_ADDRESS_DICT'))
+@lru_cache(maxsize=4)
+def parse_address_dict(address_dict_str: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+    # parsed once per distinct SIGNAL_ADDRESS_DICT instead of once per lookup
+    address_dict = json.loads(address_dict_str)
     id_dict = {e['id']: e['name'] for e in address_dict if e['id'] is not None}
+    number_dict = {e['number']: e['name'] for e in address_dict if e['number'] is not None}
+    return id_dict, number_dict
+
+
+def get_sender_from_uuid(sender_uuid: str) -> Optional[str]:
+    id_dict, _ = parse_address_dict(os.getenv('SIGNAL_ADDRESS_DICT'))
     if sender_uuid in id_dict:
         return id_dict[sender_uuid]
     else:
@@ -30,8 +53,7 @@ def get_sender_from_uuid(sender_uuid: str) -> Optional[str]:
 
 
 def get_sender_from_number(sender_number: str) -> Optional[str]:
-    address_dict = json.loads(os.getenv('SIGNAL_ADDRESS_DICT'))
-    number_dict = {e['number']: e['name'] for e in address_dict if e['number'] is not None}
+    _, number_dict = parse_address_dict(os.getenv('SIGNAL_ADDRESS_DICT'))
     if sender_number in number_dict:
         return number_dict[sender_number]
     else:
@@ -66,7 +88,28 @@ def add_sender_str(msg_dict_envelope: dict) -> dict:
     return msg_dict_envelope
 
 
-def add_payload_data(msg_dict_envelope: dict) -> dict:
+def get_image_attachment_files(msg_dict_list: List[dict]) -> List[Tuple[str, Path]]:
+    """
+    image attachments of the envelopes that will be forwarded, i.e. data messages of the configured group
+    """
+    attachment_path = Path(os.getenv('SIGNAL_CONFIG'), "attachments")
+    group_id = os.getenv('SIGNAL_GROUP_ID')
+    attachment_list = []
+    for msg_dict in msg_dict_list:
+        envelope = msg_dict.get('envelope', {})
+        if 'receiptMessage' in envelope or 'dataMessage' not in envelope or get_group_id(envelope) != group_id:
+            continue
+        data_message = envelope['dataMessage'] or {}
+        for attachment in data_message.get('attachments', []):
+            attachment_file = Path(attachment_path, attachment['id'])
+            if is_image(attachment.get('filename'), attachment.get('contentType')) and attachment_file.exists():
+                attachment_list.append((attachment['id'], attachment_file))
+    return attachment_list
+
+
+def add_payload_data(msg_dict_envelope: dict, transcoded: Optional[Dict[str, Tuple[bytes, str]]] = None) -> dict:
+    if transcoded is None:
+        transcoded = {}
     if 'dataMessage' in msg_dict_envelope and 'attachments' in msg_dict_envelope['dataMessage']:
         attachment_path = Path(os.getenv('SIGNAL_CONFIG'), "attachments")
         assert attachment_path.exists()
@@ -74,22 +117,65 @@ def add_payload_data(msg_dict_envelope: dict) -> dict:
         for attachment in msg_dict_envelope['dataMessage']['attachments']:
             attachment_file = Path(attachment_path, attachment['id'])
             assert attachment_file.exists()
-            if os.stat(attachment_file).st_size < 1e7:
+            transcoded_data, ext = transcoded.get(attachment['id'], (None, None))
+            # the 10MB limit also applies to transcoded images, a re-encoded PNG may still be too big
+            size = os.stat(attachment_file).st_size if transcoded_data is None else len(transcoded_data)
+            if size >= 1e7:
+                LOGGER.error(f'file {attachment_file.absolute()=}: size too big: {size=}')
+                attachment['base64'] = None
+            elif transcoded_data is not None:
+                attachment['base64'] = base64.b64encode(transcoded_data).decode('utf-8')
+                attachment['size'] = len(transcoded_data)
+                attachment['contentType'] = CONTENT_TYPE_DICT[ext]
+                if attachment.get('filename') is not None:
+                    attachment['filename'] = replace_extension(attachment['filename'], ext)
+                LOGGER.info(f'file {attachment_file.absolute()=}: transcoded base64 written')
+            else:
                 with open(attachment_file, "rb") as att_file:
                     attachment['base64'] = base64.b64encode(att_file.read()).decode('utf-8')
                 LOGGER.info(f'file {attachment_file.absolute()=}: base64 written')
-            else:
-                LOGGER.error(
-                    f'file {attachment_file.absolute()=}: size too big: {os.stat(attachment_file).st_size=}')
-                attachment['base64'] = None
     return msg_dict_envelope
 
 
-def process_cli_response(response_bytes: bytes) -> Dict[str, List[Dict[str, Union[None, str, int, dict]]]]:
+def drop_repeated_envelopes(msg_dict_list: List[dict]) -> List[dict]:
+    seen_filter = get_seen_filter()
+    result = []
+    for msg_dict in msg_dict_list:
+        envelope = msg_dict['envelope']
+        if 'dataMessage' in envelope and 'exception' not in msg_dict:
+            source = envelope.get('sourceUuid') or envelope.get('sourceNumber')
+            if source is not None and seen_filter.check_and_add(signal_key(source, envelope['timestamp'])):
+                LOGGER.info(f"dropping repeated envelope: {source=}, {envelope['timestamp']=}")
+                continue
+        result.append(msg_dict)
+    return result
+
+
+def drop_checkpointed_envelopes(msg_dict_list: List[dict], checkpoint: Dict[str, int]) -> List[dict]:
+    result = []
+    for msg_dict in msg_dict_list:
+        envelope = msg_dict['envelope']
+        if 'dataMessage' in envelope and get_checkpoint_timestamp(envelope) <= checkpoint.get(msg_dict['account'], -1):
+            LOGGER.info(f"dropping envelope at or below the receive checkpoint: {envelope['timestamp']=}")
+            continue
+        result.append(msg_dict)
+    return result
+
+
+def process_cli_response(response_bytes: bytes, checkpoint: Optional[Dict[str, int]] = None) -> \
+        Dict[str, List[Dict[str, Union[None, str, int, dict]]]]:
     results_json_list = [json.loads(e.strip()) for e in response_bytes.decode('utf-8').split('\n') if
                          e.strip() != '' and 'envelope' in e]
+    if checkpoint is not None:
+        results_json_list = drop_checkpointed_envelopes(results_json_list, checkpoint)
+    results_json_list = drop_repeated_envelopes(results_json_list)
 
     results_json_dict = defaultdict(list)
+    # messages of this response are not in the message index before they are sent, but may already be quoted
+    pending_entries = {}
+    transcoded = {}
+    if image_transcode_enabled():
+        transcoded = transcode_attachment_files(get_image_attachment_files(results_json_list))
 
     for msg_dict in results_json_list:
         if 'exception' in msg_dict:
@@ -123,9 +209,14 @@ def process_cli_response(response_bytes: bytes) -> Dict[str, List[Dict[str, Unio
 
         envelope = add_sender_str(envelope)
         envelope = add_timestamp_str(envelope)
-        envelope = add_payload_data(envelope)
-        envelope = add_quote_message(envelope)
-        envelope = add_emoji_reaction(envelope)
+        envelope = add_payload_data(envelope, transcoded)
+        envelope = add_message_id(envelope)
+        envelope = add_quote_message(envelope, pending_entries)
+        envelope = add_emoji_reaction(envelope, pending_entries)
+        snippet = get_index_snippet(envelope)
+        if snippet is not None:
+            for author in get_authors(envelope):
+                pending_entries[(author, int(envelope['timestamp']))] = IndexEntry(snippet, envelope['messageId'])
 
         results_json_dict[msg_dict['account']].append(envelope)
 
@@ -134,7 +225,49 @@ def process_cli_response(response_bytes: bytes) -> Dict[str, List[Dict[str, Unio
     return results_json_dict
 
 
-def add_quote_message(msg_dict_envelope: dict) -> dict:
+def add_message_id(msg_dict_envelope: dict) -> dict:
+    mail_user = os.getenv('MAIL_USER')
+    domain = mail_user.split('@')[-1] if mail_user is not None and '@' in mail_user else None
+    msg_dict_envelope['messageId'] = make_msgid(idstring='signalBot', domain=domain)
+    return msg_dict_envelope
+
+
+def get_authors(msg_dict_envelope: dict) -> List[Optional[str]]:
+    return [msg_dict_envelope.get('sourceUuid'), msg_dict_envelope.get('sourceNumber')]
+
+
+def get_index_snippet(msg_dict_envelope: dict) -> Optional[str]:
+    data_message = msg_dict_envelope['dataMessage']
+    if 'reaction' in data_message:
+        return None
+    snippet = make_snippet(data_message.get('message'))
+    if snippet == '' and data_message.get('attachments'):
+        snippet = '[Anhang: ' + ', '.join([str(a['filename'] or a['id']) for a in data_message['attachments']]) + ']'
+    return snippet
+
+
+def add_to_message_index(msg_dict_envelope: dict, message_id: Optional[str]) -> None:
+    """
+    records a forwarded message, commit with get_message_index().commit() after the batch
+    """
+    snippet = get_index_snippet(msg_dict_envelope)
+    if snippet is not None:
+        get_message_index().add(get_authors(msg_dict_envelope), msg_dict_envelope['timestamp'], snippet, message_id)
+
+
+def lookup_message(authors: List[Optional[str]], sent_timestamp: int,
+                   pending_entries: Optional[Dict[Tuple[str, int], IndexEntry]] = None) -> Optional[IndexEntry]:
+    for author in authors:
+        if pending_entries is not None and (author, int(sent_timestamp)) in pending_entries:
+            return pending_entries[(author, int(sent_timestamp))]
+    if not get_message_index_path().exists():
+        # nothing has been forwarded yet, parsing must not create the index
+        return None
+    return get_message_index().lookup(authors, sent_timestamp)
+
+
+def add_quote_message(msg_dict_envelope: dict,
+                      pending_entries: Optional[Dict[Tuple[str, int], IndexEntry]] = None) -> dict:
     if "quote" in msg_dict_envelope['dataMessage']:
         ref_number = msg_dict_envelope['dataMessage']['quote']['authorNumber']
         ref_uuid = msg_dict_envelope['dataMessage']['quote']['authorUuid']
@@ -150,6 +283,11 @@ def add_quote_message(msg_dict_envelope: dict) -> dict:
 
         ref_text = msg_dict_envelope['dataMessage']['quote']['text']
 
+        ref_entry = lookup_message([ref_uuid, ref_number], msg_dict_envelope['dataMessage']['quote']['id'],
+                                   pending_entries)
+        if ref_entry is not None and ref_entry.message_id is not None:
+            msg_dict_envelope['inReplyTo'] = ref_entry.message_id
+
         tmp_text = "[[ quote answer ]]\n"
         tmp_text += f"to message from sender: {ref_sender}\n\n"
         tmp_text += f"{ref_text}\n"
@@ -158,7 +296,8 @@ def add_quote_message(msg_dict_envelope: dict) -> dict:
     return msg_dict_envelope
 
 
-def add_emoji_reaction(msg_dict_envelope: dict) -> dict:
+def add_emoji_reaction(msg_dict_envelope: dict,
+                       pending_entries: Optional[Dict[Tuple[str, int], IndexEntry]] = None) -> dict:
     if "reaction" in msg_dict_envelope['dataMessage']:
         if "emoji" in msg_dict_envelope['dataMessage']['reaction']:
             ref_number = msg_dict_envelope['dataMessage']['reaction']['targetAuthorNumber']
@@ -176,24 +315,30 @@ def add_emoji_reaction(msg_dict_envelope: dict) -> dict:
             ref_timestamp = msg_dict_envelope['dataMessage']['reaction']['targetSentTimestamp']
 
             emoji = msg_dict_envelope['dataMessage']['reaction']['emoji']
+            ref_entry = lookup_message([ref_uuid, ref_number], ref_timestamp, pending_entries)
+            if ref_entry is not None and ref_entry.message_id is not None:
+                msg_dict_envelope['inReplyTo'] = ref_entry.message_id
             if 'message' not in msg_dict_envelope['dataMessage'] or msg_dict_envelope['dataMessage']['message'] is None:
                 msg_dict_envelope['dataMessage']['message'] = ""
             msg_dict_envelope['dataMessage']['message'] += "[[ emoji reaction ]]\n"
             msg_dict_envelope['dataMessage']['message'] += f"to message from sender: {ref_sender}\n"
             msg_dict_envelope['dataMessage']['message'] += f"to message from date: " \
                                                            f"{reformat_timestamp(ref_timestamp)}\n"
+            if ref_entry is not None:
+                msg_dict_envelope['dataMessage']['message'] += f"to message: {ref_entry.snippet}\n"
             msg_dict_envelope['dataMessage']['message'] += f"emoji: {emoji}\n"
     return msg_dict_envelope
 
 
-def receive_messages(signal_number: str, cli_exec_path: str, config_path: str, verbose: bool = False) -> dict:
-    """
-    receive messages
-    """
-
+def run_signal_cli_receive(signal_number: str, cli_exec_path: str, config_path: str, verbose: bool = False,
+                           receive_args: Optional[List[str]] = None) -> Any:
+    if receive_args is None:
+        receive_args = []
     # get response (byte string) of signal-cli command "receive"
-    response = run_signal_cli_command(['-a', signal_number, '-o', 'json', 'receive'], cli_exec_path, config_path,
-                                      verbose)
+    start = time.monotonic()
+    response = run_signal_cli_command(['-a', signal_number, '-o', 'json', 'receive', *receive_args], cli_exec_path,
+                                      config_path, verbose)
+    capture_signal_receive(response.stdout, response.returncode, time.monotonic() - start)
     if response.returncode != 0:
         from cryptography.fernet import Fernet
         fernet = Fernet(ENCRYPTION_KEY.encode('utf-8'))
@@ -207,6 +352,14 @@ def receive_messages(signal_number: str, cli_exec_path: str, config_path: str, v
     if response.returncode != 0:
         LOGGER.error(
             'returncode: {0}\nstdout: {1}\nstderr: {2}'.format(response.returncode, response.stdout, response.stderr))
+    return response
+
+
+def receive_messages(signal_number: str, cli_exec_path: str, config_path: str, verbose: bool = False) -> dict:
+    """
+    receive messages
+    """
+    response = run_signal_cli_receive(signal_number, cli_exec_path, config_path, verbose)
     return dict(process_cli_response(response.stdout))
 
 
@@ -215,6 +368,77 @@ def run_signal_bot_receive():
                             verbose=True)
 
 
+def backlog_mode_enabled() -> bool:
+    return get_env_flag('SIGNAL_RECEIVE_BACKLOG_MODE')
+
+
+def get_receive_checkpoint_path() -> Path:
+    return Path(os.getenv('SIGNAL_RECEIVE_CHECKPOINT', './data/receive_checkpoint.json'))
+
+
+def get_checkpoint_timestamp(msg_dict_envelope: dict) -> int:
+    # the server timestamp follows the receive order, the sender timestamp may lag behind for delayed messages
+    return int(msg_dict_envelope.get('serverReceivedTimestamp') or msg_dict_envelope['timestamp'])
+
+
+def update_receive_checkpoint(checkpoint: Dict[str, int],
+                              messages: Dict[str, List[Dict[str, Union[None, str, int, dict]]]]) -> Dict[str, int]:
+    """
+    advances the checkpoint per account to the latest message that has been forwarded (sent or spooled)
+    """
+    for account, msg_list in messages.items():
+        forwarded = [get_checkpoint_timestamp(m) for m in msg_list if m.get('forwarded')]
+        if forwarded:
+            checkpoint[account] = max([checkpoint.get(account, 0)] + forwarded)
+    return checkpoint
+
+
+def receive_messages_backlog(signal_number: str, cli_exec_path: str, config_path: str, verbose: bool = False,
+                             process_chunk: Optional[Callable[[dict], int]] = None,
+                             clock: Callable[[], float] = time.monotonic) -> Tuple[int, int]:
+    """
+    receive and forward messages in bounded chunks until the queue is drained or the time budget is used up;
+    returns the number of received envelopes and the number of sent mails
+    """
+    if process_chunk is None:
+        process_chunk = process_signal_msgs_to_mail
+    max_messages = get_env_int('SIGNAL_RECEIVE_MAX_MESSAGES', DEFAULT_RECEIVE_MAX_MESSAGES)
+    timeout = get_env_int('SIGNAL_RECEIVE_TIMEOUT', DEFAULT_RECEIVE_TIMEOUT)
+    time_budget = get_env_int('SIGNAL_RECEIVE_TIME_BUDGET', DEFAULT_RECEIVE_TIME_BUDGET)
+    checkpoint_path = get_receive_checkpoint_path()
+    checkpoint = read_json_file(checkpoint_path, default={})
+
+    received, sent, chunk_no = 0, 0, 0
+    start = clock()
+    while clock() - start < time_budget:
+        response = run_signal_cli_receive(signal_number, cli_exec_path, config_path, verbose,
+                                          ['--timeout', str(timeout), '--max-messages', str(max_messages)])
+        envelope_count = len([e for e in response.stdout.split(b'\n') if b'envelope' in e])
+        # envelopes up to the checkpoint were forwarded before, e.g. by a run that crashed before signal-cli was done
+        msgs = dict(process_cli_response(response.stdout, checkpoint))
+        chunk_sent = process_chunk(msgs)
+
+        checkpoint = update_receive_checkpoint(checkpoint, msgs)
+        write_json_file(checkpoint_path, checkpoint)
+        save_seen_filter()
+
+        chunk_no += 1
+        received += envelope_count
+        sent += chunk_sent
+        LOGGER.info(f'{chunk_no=}, {envelope_count=}, {chunk_sent=}, {checkpoint=}')
+        if response.returncode != 0 or envelope_count < max_messages:
+            break
+    else:
+        LOGGER.info(f'time budget of {time_budget}s used up after {chunk_no} chunks, remaining messages are '
+                    f'received in the next run')
+    return received, sent
+
+
+def run_signal_bot_receive_backlog() -> Tuple[int, int]:
+    return receive_messages_backlog(os.getenv('SIGNAL_NUMBER'), os.getenv('SIGNAL_CLI'), os.getenv('SIGNAL_CONFIG'),
+                                    verbose=True)
+
+
 def process_message_text(message: dict, msg: str):
     if 'dataMessage' in message:
         if 'message' in message['dataMessage']:
@@ -252,40 +476,77 @@ def get_group_id(message: dict) -> Optional[str]:
     return group_id
 
 
+def prepare_signal_msg_for_mail(message: Dict[str, Union[None, str, int, dict]]) -> \
+        Tuple[str, str, List[Tuple[str, str]], Dict[str, str]]:
+    subject = f"drahtesel*innen / {message['timestamp_str']} / {message['source']}"
+    msg = f"Date: {reformat_timestamp(int(message['timestamp']))}\n" \
+          f"From: {message['source']}\n" \
+          f"To: drahtesel*innen signal chat\n\n" \
+          f"====================\n\n"
+
+    msg = process_message_text(message, msg)
+    msg, signal_attachments = process_attachments(message, msg)
+    return subject, msg, signal_attachments, get_mail_headers(message)
+
+
 def prepare_signal_msgs_for_mail(messages: Dict[str, List[Dict[str, Union[None, str, int, dict]]]],
                                  filter_group_id: Optional[str]) -> \
-        Tuple[List[Tuple[str, str, List[Tuple[str, str]]]], List[Tuple[str, str, List[Tuple[str, str]]]]]:
+        Tuple[List[Tuple[str, str, List[Tuple[str, str]], Dict[str, str]]],
+              List[Tuple[str, str, List[Tuple[str, str]], Dict[str, str]]]]:
     result, filtered = [], []
     for message in flatten(list(messages.values())):
-        msg_group_id = get_group_id(message)
-
-        subject = f"drahtesel*innen / {message['timestamp_str']} / {message['source']}"
-        msg = f"Date: {reformat_timestamp(int(message['timestamp']))}\n" \
-              f"From: {message['source']}\n" \
-              f"To: drahtesel*innen signal chat\n\n" \
-              f"====================\n\n"
-
-        msg = process_message_text(message, msg)
-        msg, signal_attachments = process_attachments(message, msg)
-        return_tuple = (subject, msg, signal_attachments)
-        if msg_group_id == filter_group_id:
+        return_tuple = prepare_signal_msg_for_mail(message)
+        if get_group_id(message) == filter_group_id:
             result.append(return_tuple)
         else:
             filtered.append(return_tuple)
     return result, filtered
 
 
-def process_signal_msgs_to_mail(messages: Dict[str, List[Dict[str, Union[None, str, int, dict]]]]) -> int:
-    mail_msgs, filtered_messages = prepare_signal_msgs_for_mail(messages, os.getenv('SIGNAL_GROUP_ID'))
-    return send_signal_msgs_via_mail(mail_msgs)
+def get_mail_headers(message: dict) -> Dict[str, str]:
+    headers = {}
+    if message.get('messageId') is not None:
+        headers['Message-ID'] = message['messageId']
+    if message.get('inReplyTo') is not None:
+        headers['In-Reply-To'] = message['inReplyTo']
+        headers['References'] = message['inReplyTo']
+    return headers
 
 
-def send_signal_msgs_via_mail(messages: List[Tuple[str, str, List[Tuple[str, str]]]]) -> int:
+def process_signal_msgs_to_mail(messages: Dict[str, List[Dict[str, Union[None, str, int, dict]]]]) -> int:
+    group_id = os.getenv('SIGNAL_GROUP_ID')
+    all_messages = flatten(list(messages.values()))
+    group_messages = [message for message in all_messages if get_group_id(message) == group_id]
+    if digest_mode_enabled():
+        done = process_signal_msgs_to_digest(group_messages)
+        # no mail carries the Message-IDs of digest messages, only keep the snippets for later reactions
+        for message in group_messages:
+            add_to_message_index(message, None)
+            message['forwarded'] = True
+    else:
+        done = 0
+        batch_ids = {message.get('messageId') for message in all_messages}
+        forwarded_ids = set()
+        for message in group_messages:
+            if message.get('inReplyTo') in batch_ids and message['inReplyTo'] not in forwarded_ids:
+                # the referenced message of this batch was not sent (other group or failed), no mail has that id
+                del message['inReplyTo']
+            sent = send_signal_msgs_via_mail([prepare_signal_msg_for_mail(message)])
+            if sent > 0:
+                add_to_message_index(message, message['messageId'])
+                message['forwarded'] = True
+                forwarded_ids.add(message['messageId'])
+            done += sent
+    get_message_index().commit()
+    return done
+
+
+def send_signal_msgs_via_mail(messages: List[Tuple[str, str, List[Tuple[str, str]], Dict[str, str]]]) -> int:
     done = 0
     try:
-        for subject, msg, signal_attachments in messages:
+        for subject, msg, signal_attachments, headers in messages:
             for mail_address in json.loads(os.getenv('MAIL_ADDRESS_LIST_FORWARD_TO')):
-                rc = send_mail(mail_address, msg, subject, signal_attachments)
+                rc = send_mail(mail_address, msg, subject, signal_attachments, headers)
                 if rc:
                     done += 1
     except Exception:
@@ -304,6 +565,7 @@ def process_mail_to_signal_msg(mail: Email):
     if mail.body_list is not None:
         tmp_str += '\n\n'.join(mail.body_list) + '\n'
 
+    mail.attachments_list = transcode_mail_attachments(mail.attachments_list)
     if mail.attachments_list:
         tmp_str += f'Attachments:\n<'
         att_filenames = [att_filename for att_filename, _ in mail.attachments_list]
@@ -329,14 +591,31 @@ def send_message_admin(text: str, attachment: Optional[Path] = None) -> None:
 
 
 def send_message_user_number(recipient_user_number: str, text: str, attachment: Optional[Path] = None):
+    if message_from_stdin_enabled():
+        for part, attachment_cmd in split_message_parts(text, attachment):
+            send_message(cmd_send_to_user_number(text=part, recipient_user_number=recipient_user_number,
+                                                 base_cmd=None, attachment_cmd=attachment_cmd,
+                                                 message_from_stdin=True), input_text=part)
+        return
     send_message(cmd_send_to_user_number(text=text, recipient_user_number=recipient_user_number, base_cmd=None,
                                          attachment_cmd=cmd_add_attachment(attachment)))
 
 
 def send_message_group_id(recipient_group_id: str, text: str, attachment: Optional[Path] = None):
+    if message_from_stdin_enabled():
+        for part, attachment_cmd in split_message_parts(text, attachment):
+            send_message(cmd_send_to_group(text=part, recipient_group_id=recipient_group_id, base_cmd=None,
+                                           attachment_cmd=attachment_cmd, message_from_stdin=True), input_text=part)
+        return
     send_message(cmd_send_to_group(text=text, recipient_group_id=recipient_group_id, base_cmd=None,
                                    attachment_cmd=cmd_add_attachment(attachment)))
 
 
+def split_message_parts(text: str, attachment: Optional[Path]) -> List[Tuple[str, List[str]]]:
+    # the attachment goes with the last part, so that it follows the complete text
+    parts = split_message_text(text, get_env_int('SIGNAL_MESSAGE_MAX_LENGTH', DEFAULT_MESSAGE_MAX_LENGTH))
+    return [(part, cmd_add_attachment(attachment) if i == len(parts) - 1 else []) for i, part in enumerate(parts)]
+
+
 if __name__ == '__main__':
     pass
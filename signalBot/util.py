@@ -1,8 +1,10 @@
 import datetime
+import json
 import logging
 import os
 import subprocess
 import time
+import traceback
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Tuple, List, Optional, Any
@@ -87,38 +89,76 @@ def convert_epoch_timestamp_into_str(epoch_timestamp):
 
 
 def run_signal_cli_command(cmd: List[str], cli_exec_path: str, config_path: str, verbose: bool = False,
-                           **kwargs) -> Any:
+                           input_text: Optional[str] = None, **kwargs) -> Any:
     base_cmd = [cli_exec_path, "--config", config_path]
     if verbose:
         base_cmd.append('-v')
     full_cmd = base_cmd + cmd
     LOGGER.info(f'{" ".join(full_cmd)=}')
-    return subprocess.run(full_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    input_bytes = input_text.encode('utf-8') if input_text is not None else None
+    return subprocess.run(full_cmd, input=input_bytes, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
 
 def cmd_send_to_group(text: str, recipient_group_id: str, base_cmd: Optional[List[str]] = None,
-                      attachment_cmd: Optional[List[str]] = None) -> List[str]:
+                      attachment_cmd: Optional[List[str]] = None, message_from_stdin: bool = False) -> List[str]:
     if base_cmd is None:
         base_cmd = cmd_base_send()
     if attachment_cmd is None:
         attachment_cmd = []
-    return cmd_full(base_cmd, ['-g', recipient_group_id], text, attachment_cmd, [])
+    return cmd_full(base_cmd, ['-g', recipient_group_id], text, attachment_cmd, [], message_from_stdin)
 
 
 def cmd_send_to_user_number(text: str, recipient_user_number: str, base_cmd: Optional[List[str]] = None,
-                            attachment_cmd: Optional[List[str]] = None) -> List[str]:
+                            attachment_cmd: Optional[List[str]] = None, message_from_stdin: bool = False) -> List[str]:
     if base_cmd is None:
         base_cmd = cmd_base_send()
     if attachment_cmd is None:
         attachment_cmd = []
-    return cmd_full(base_cmd, [], text, attachment_cmd, [recipient_user_number])
+    return cmd_full(base_cmd, [], text, attachment_cmd, [recipient_user_number], message_from_stdin)
 
 
 def cmd_full(base_cmd: List[str], group_cmd: List[str], text: str, attachment_cmd: List[str],
-             user_number_cmd: List[str]) -> List[str]:
+             user_number_cmd: List[str], message_from_stdin: bool = False) -> List[str]:
+    if message_from_stdin:
+        # the text itself is passed to send_message as input_text
+        return [*base_cmd, *group_cmd, '--message-from-stdin', *attachment_cmd, *user_number_cmd]
     return [*base_cmd, *group_cmd, '-m', shell_quote(text), *attachment_cmd, *user_number_cmd]
 
 
+def message_from_stdin_enabled() -> bool:
+    return get_env_flag('SIGNAL_MESSAGE_FROM_STDIN')
+
+
+def split_message_text(text: str, max_length: int) -> List[str]:
+    """
+    splits text into ordered parts of at most max_length characters, preferably at paragraph boundaries, then at
+    line boundaries; every part is prefixed with [i/n] if more than one part is needed
+    """
+    if len(text) <= max_length:
+        return [text]
+    # room for the "[i/n]\n" prefix
+    max_length = max(max_length - 16, 1)
+    parts, current = [], ''
+    for paragraph in text.split('\n\n'):
+        pieces = [paragraph]
+        if len(paragraph) > max_length:
+            pieces = flatten([[line[i:i + max_length] for i in range(0, max(len(line), 1), max_length)]
+                              for line in paragraph.split('\n')])
+            pieces = [piece for piece in pieces if piece != ''] or ['']
+            separators = ['\n\n'] + ['\n'] * (len(pieces) - 1)
+        else:
+            separators = ['\n\n']
+        for separator, piece in zip(separators, pieces):
+            candidate = piece if current == '' else current + separator + piece
+            if len(candidate) <= max_length:
+                current = candidate
+            else:
+                parts.append(current)
+                current = piece
+    parts.append(current)
+    return [f'[{i + 1}/{len(parts)}]\n{part}' for i, part in enumerate(parts)]
+
+
 def cmd_add_attachment(attachment_path: Optional[Path]) -> List[Optional[str]]:
     if attachment_path is not None:
         return ['-a', str(attachment_path.absolute())]
@@ -136,7 +176,8 @@ def cmd_base_send(signal_number: Optional[str] = None):
     return ['-a', signal_number, '-o', 'json', 'send']
 
 
-def send_message(cmd: List[str], config_path: Optional[str] = None, cli_exec_path: Optional[str] = None) -> Any:
+def send_message(cmd: List[str], config_path: Optional[str] = None, cli_exec_path: Optional[str] = None,
+                 input_text: Optional[str] = None) -> Any:
     if cli_exec_path is None:
         cli_exec_path = os.getenv("SIGNAL_CLI")
     if config_path is None:
@@ -145,7 +186,8 @@ def send_message(cmd: List[str], config_path: Optional[str] = None, cli_exec_pat
         assert cli_exec_path is not None and config_path is not None
     except AssertionError:
         LOGGER.error(f"ERROR: {cli_exec_path=}, {config_path=}")
-    return run_signal_cli_command(cmd=cmd, cli_exec_path=cli_exec_path, config_path=config_path)
+    return run_signal_cli_command(cmd=cmd, cli_exec_path=cli_exec_path, config_path=config_path,
+                                  input_text=input_text)
 
 
 def shell_quote(item):
@@ -181,3 +223,39 @@ LOGGER = logging.getLogger('debugger')
 
 def flatten(ll: list) -> list:
     return [a for e in ll for a in e]
+
+
+def get_env_flag(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None or value.strip() == '':
+        return default
+    return value.strip().lower() in ['1', 'true', 'yes', 'on']
+
+
+def get_env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if value is None or value.strip() == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        LOGGER.error(f'invalid integer in env variable {name}: {value=}; using {default=}')
+        return default
+
+
+def read_json_file(file_path: Path, default: Any = None) -> Any:
+    if not file_path.exists():
+        return default
+    try:
+        return json.loads(file_path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        LOGGER.error(f'could not read json file {file_path.absolute()=}: {traceback.format_exc()}')
+        return default
+
+
+def write_json_file(file_path: Path, data: Any) -> None:
+    # write to a temporary file first so that a crash never leaves a truncated file behind
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = Path(file_path.parent, file_path.name + '.tmp')
+    tmp_path.write_text(json.dumps(data), encoding='utf-8')
+    os.replace(tmp_path, file_path)
@@ -0,0 +1,71 @@
+"""
+benchmark of the two signal-cli send paths for long message bodies: text in argv ('-m', shell quoted) and text
+over stdin ('--message-from-stdin', split into parts); the round trip goes through the fake signal-cli
+
+    python -m tests.loadtest.bench_send [--size 100000] [--repeat 20]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import timeit
+from pathlib import Path
+from unittest.mock import patch
+
+from tests.loadtest.run_load_test import write_fake_signal_cli
+
+
+def make_body(size: int) -> str:
+    paragraph = 'Hallo zusammen, "Treffen" am Samstag um 10 Uhr - bitte $5 & Werkzeug mitbringen!\n' \
+                '> it\'s a quoted reply | with <brackets>\n'
+    paragraphs = []
+    while sum([len(p) + 2 for p in paragraphs]) < size:
+        paragraphs.append(f'{len(paragraphs)}: {paragraph}')
+    return '\n\n'.join(paragraphs)[:size]
+
+
+def bench_prepare(body: str, repeat: int) -> None:
+    from signalBot.util import cmd_send_to_group, split_message_text
+    argv = timeit.timeit(lambda: cmd_send_to_group(body, 'group', base_cmd=['send']), number=repeat) / repeat
+    stdin = timeit.timeit(lambda: [cmd_send_to_group(part, 'group', base_cmd=['send'], message_from_stdin=True)
+                                   for part in split_message_text(body, 16000)], number=repeat) / repeat
+    print(f'prepare argv:  {argv * 1000:.3f}ms per message')
+    print(f'prepare stdin: {stdin * 1000:.3f}ms per message (incl. splitting)')
+
+
+def bench_round_trip(body: str, repeat: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        send_log = Path(tmp_dir, 'send_log.ndjson')
+        env = {'ENCRYPTION_KEY': os.getenv('ENCRYPTION_KEY', 'bench'), 'SIGNAL_NUMBER': '+49100000',
+               'SIGNAL_CLI': str(write_fake_signal_cli(Path(tmp_dir))), 'SIGNAL_CONFIG': tmp_dir,
+               'FAKE_SIGNAL_CLI_SEND_LOG': str(send_log), 'FAKE_SIGNAL_CLI_DELAY': '0'}
+        for mode in ['false', 'true']:
+            with patch.dict(os.environ, dict(env, SIGNAL_MESSAGE_FROM_STDIN=mode)):
+                from signalBot.signalBot import send_message_group_id
+                send_log.unlink(missing_ok=True)
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    send_message_group_id('group', body)
+                seconds = (time.perf_counter() - start) / repeat
+            records = [json.loads(line) for line in send_log.read_text(encoding='utf-8').splitlines()]
+            parts = len(records) // repeat
+            received = sum([r['length'] for r in records[:parts]])
+            name = 'stdin' if mode == 'true' else 'argv'
+            print(f'round trip {name}: {seconds * 1000:.1f}ms per message, {parts} part(s), '
+                  f'{received} characters received for {len(body)} sent')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='benchmark signal-cli send paths for long bodies')
+    parser.add_argument('--size', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    body = make_body(args.size)
+    bench_prepare(body, args.repeat)
+    bench_round_trip(body, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+stand-in for the signal-cli executable used by the load test harness
+
+receive: emits the next envelopes of the NDJSON file FAKE_SIGNAL_CLI_STREAM (honouring --max-messages), the read
+         position is kept in FAKE_SIGNAL_CLI_STATE
+send:    appends one JSON line per call to FAKE_SIGNAL_CLI_SEND_LOG, the text is taken from -m or, with
+         --message-from-stdin, from stdin
+every call sleeps FAKE_SIGNAL_CLI_DELAY seconds first to mimic the JVM start-up
+"""
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional
+
+
+def get_option(args: List[str], *names: str) -> Optional[str]:
+    for name in names:
+        if name in args and args.index(name) + 1 < len(args):
+            return args[args.index(name) + 1]
+    return None
+
+
+def receive(args: List[str]) -> None:
+    stream_file = Path(os.environ['FAKE_SIGNAL_CLI_STREAM'])
+    state_file = Path(os.environ['FAKE_SIGNAL_CLI_STATE'])
+    max_messages = get_option(args, '--max-messages')
+
+    offset = int(state_file.read_text()) if state_file.exists() else 0
+    lines = stream_file.read_text(encoding='utf-8').splitlines() if stream_file.exists() else []
+    end = len(lines) if max_messages is None else min(len(lines), offset + int(max_messages))
+    now = int(time.time() * 1000)
+    for line in lines[offset:end]:
+        envelope = json.loads(line)
+        envelope['envelope']['serverReceivedTimestamp'] = now
+        sys.stdout.write(json.dumps(envelope) + '\n')
+    state_file.write_text(str(end))
+
+
+def send(args: List[str]) -> None:
+    if '--message-from-stdin' in args:
+        text = sys.stdin.read()
+    else:
+        text = get_option(args, '-m', '--message')
+    record = {'ts': time.time(), 'group': get_option(args, '-g', '--group-id'),
+              'attachment': get_option(args, '-a', '--attachment'), 'length': len(text or ''),
+              'text': (text or '')[:300]}
+    with open(os.environ['FAKE_SIGNAL_CLI_SEND_LOG'], 'a', encoding='utf-8') as send_log:
+        send_log.write(json.dumps(record) + '\n')
+    sys.stdout.write(json.dumps({'timestamp': int(time.time() * 1000)}) + '\n')
+
+
+def main(args: List[str]) -> int:
+    time.sleep(float(os.getenv('FAKE_SIGNAL_CLI_DELAY', '0')))
+    command = next((i for i, arg in enumerate(args) if arg in ['receive', 'send']), None)
+    # only look at the options after the command, '-a' is the account before and the attachment after 'send'
+    if command is not None and args[command] == 'receive':
+        receive(args[command + 1:])
+    elif command is not None and args[command] == 'send':
+        send(args[command + 1:])
+    else:
+        sys.stderr.write(f'unsupported command: {args}\n')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,192 @@
+"""
+end-to-end load test: runs signalBot.main against a fake signal-cli, a local SMTP sink and a scripted IMAP server
+and reports forwarding latency percentiles, throughput and peak RSS of the bot process
+
+    python -m tests.loadtest.run_load_test --sizes 10 1000 10000 [--delay 0.5] [--env MAIL_DIGEST_MODE=true]
+"""
+import argparse
+import json
+import os
+import re
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from email.mime.text import MIMEText
+from email.utils import formatdate, make_msgid
+from pathlib import Path
+from typing import List, Dict, Optional
+
+from tests.loadtest.servers import make_self_signed_cert, SmtpSink, ImapStandIn
+
+REPO_ROOT = Path(__file__).absolute().parents[2]
+FAKE_SIGNAL_CLI = Path(__file__).absolute().parent / 'fake_signal_cli.py'
+
+ACCOUNT = '+49100000'
+GROUP_ID = 'loadtestGroupId0123456789abcdefghijklmnopq='
+MEMBER_ADDRESS = 'member@example.com'
+SENDER_ADDRESS = 'sender@example.com'
+ADDRESS_DICT = [{'name': f'Person{i}', 'id': f'uuid-{i}', 'number': f'+4920000000{i}'} for i in range(5)]
+
+MARKER = re.compile(r'loadtest-(signal|mail)-(\d+)')
+
+
+@dataclass
+class LoadTestResult:
+    size: int
+    returncode: int
+    wall_seconds: float
+    peak_rss_kb: int
+    latencies: Dict[str, List[float]] = field(default_factory=dict)
+
+    @staticmethod
+    def percentile(values: List[float], p: float) -> Optional[float]:
+        if not values:
+            return None
+        values = sorted(values)
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+    def __str__(self):
+        lines = [f'n={self.size}: returncode={self.returncode}, wall={self.wall_seconds:.2f}s, '
+                 f'peak RSS={self.peak_rss_kb / 1024:.1f} MiB']
+        for direction, values in self.latencies.items():
+            if not values:
+                lines.append(f'  {direction}: nothing delivered')
+                continue
+            p50, p90, p99 = [self.percentile(values, p) for p in [50, 90, 99]]
+            lines.append(f'  {direction}: {len(values)}/{self.size} delivered, '
+                         f'latency p50={p50:.3f}s p90={p90:.3f}s p99={p99:.3f}s max={max(values):.3f}s, '
+                         f'throughput={len(values) / max(values):.1f} msg/s')
+        return '\n'.join(lines)
+
+
+def make_signal_stream(size: int, start_ms: int) -> str:
+    lines = []
+    for i in range(size):
+        person = ADDRESS_DICT[i % len(ADDRESS_DICT)]
+        envelope = {'source': person['number'], 'sourceNumber': person['number'], 'sourceUuid': person['id'],
+                    'sourceName': person['name'], 'sourceDevice': 1, 'timestamp': start_ms + i,
+                    'dataMessage': {'timestamp': start_ms + i, 'message': f'loadtest-signal-{i} ' + 'x' * 200,
+                                    'expiresInSeconds': 0, 'viewOnce': False,
+                                    'groupInfo': {'groupId': GROUP_ID, 'type': 'DELIVER'}}}
+        lines.append(json.dumps({'envelope': envelope, 'account': ACCOUNT}))
+    return '\n'.join(lines) + '\n'
+
+
+def make_mails(size: int) -> List[tuple]:
+    mails = []
+    for i in range(size):
+        mail = MIMEText(f'loadtest-mail-{i}\n\n' + 'lorem ipsum dolor sit amet\n' * 20)
+        mail['Subject'] = f'loadtest-mail-{i}'
+        mail['From'] = SENDER_ADDRESS
+        mail['To'] = 'bot@example.com'
+        mail['Date'] = formatdate(localtime=True)
+        mail['Message-ID'] = make_msgid(idstring=f'loadtest{i}', domain='example.com')
+        mails.append((SENDER_ADDRESS, mail.as_bytes().replace(b'\n', b'\r\n')))
+    return mails
+
+
+def write_fake_signal_cli(work_dir: Path) -> Path:
+    wrapper = Path(work_dir, 'signal-cli')
+    wrapper.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_SIGNAL_CLI}" "$@"\n')
+    wrapper.chmod(wrapper.stat().st_mode | stat.S_IXUSR)
+    return wrapper
+
+
+def run_load_test(size: int, directions: List[str], delay: float = 0.0, extra_env: Optional[Dict[str, str]] = None,
+                  timeout: float = 3600) -> LoadTestResult:
+    from cryptography.fernet import Fernet
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = Path(tmp_dir)
+        cert_file, key_file = Path(work_dir, 'cert.pem'), Path(work_dir, 'key.pem')
+        make_self_signed_cert(cert_file, key_file)
+        Path(work_dir, 'signal', 'attachments').mkdir(parents=True)
+
+        start_ms = int(time.time() * 1000)
+        signal_size = size if 'signal' in directions else 0
+        mail_size = size if 'mail' in directions else 0
+        Path(work_dir, 'stream.ndjson').write_text(make_signal_stream(signal_size, start_ms), encoding='utf-8')
+        smtp_sink = SmtpSink(cert_file, key_file).start()
+        imap_server = ImapStandIn(cert_file, key_file, make_mails(mail_size)).start()
+
+        env = dict(os.environ)
+        env.update({'PYTHONPATH': str(REPO_ROOT),
+                    'ENCRYPTION_KEY': Fernet.generate_key().decode('utf-8'),
+                    'SIGNAL_NUMBER': ACCOUNT,
+                    'SIGNAL_CONFIG': str(Path(work_dir, 'signal')),
+                    'SIGNAL_CLI': str(write_fake_signal_cli(work_dir)),
+                    'SIGNAL_GROUP_ID': GROUP_ID,
+                    'SIGNAL_ADDRESS_DICT': json.dumps(ADDRESS_DICT),
+                    'SIGNAL_ADMIN_NUMBER': '+49300000000',
+                    'MAIL_IMAP_SERVER': '127.0.0.1',
+                    'MAIL_IMAP_PORT': str(imap_server.port),
+                    'MAIL_IMAP_MAILBOX': 'INBOX',
+                    'MAIL_SMTP_SERVER': '127.0.0.1',
+                    'MAIL_SMTP_PORT': str(smtp_sink.port),
+                    'MAIL_USER': 'bot@example.com',
+                    'MAIL_PASS': 'loadtest',
+                    'MAIL_ADDRESS_LIST_FORWARD_TO': json.dumps([MEMBER_ADDRESS]),
+                    'MAIL_ADDRESS_LIST_FORWARD_FROM': json.dumps([SENDER_ADDRESS]),
+                    'MAIL_ADMIN_ADDRESS': json.dumps(['admin@example.com']),
+                    'FAKE_SIGNAL_CLI_STREAM': str(Path(work_dir, 'stream.ndjson')),
+                    'FAKE_SIGNAL_CLI_STATE': str(Path(work_dir, 'stream.state')),
+                    'FAKE_SIGNAL_CLI_SEND_LOG': str(Path(work_dir, 'send_log.ndjson')),
+                    'FAKE_SIGNAL_CLI_DELAY': str(delay)})
+        env.update(extra_env or {})
+
+        start = time.time()
+        with open(Path(work_dir, 'bot.log'), 'wb') as bot_log:
+            process = subprocess.Popen([sys.executable, '-m', 'signalBot.main'], cwd=work_dir, env=env,
+                                       stdout=bot_log, stderr=subprocess.STDOUT)
+            timer = threading.Timer(timeout, process.kill)
+            timer.start()
+            # wait4 instead of Popen.wait to get the rusage of exactly this bot run (ru_maxrss is in KiB on Linux)
+            _, status, rusage = os.wait4(process.pid, 0)
+            timer.cancel()
+            process.returncode = os.waitstatus_to_exitcode(status)
+            peak_rss_kb = rusage.ru_maxrss
+        wall_seconds = time.time() - start
+        for server in [smtp_sink, imap_server]:
+            server.shutdown()
+            server.server_close()
+
+        latencies = {}
+        if 'signal' in directions:
+            delivered = {}
+            for received_at, data in smtp_sink.received:
+                for kind, i in MARKER.findall(data.decode('utf-8', 'replace')):
+                    if kind == 'signal':
+                        delivered.setdefault(int(i), received_at - start)
+            latencies['signal->mail'] = list(delivered.values())
+        if 'mail' in directions:
+            delivered = {}
+            send_log = Path(work_dir, 'send_log.ndjson')
+            for line in send_log.read_text(encoding='utf-8').splitlines() if send_log.exists() else []:
+                record = json.loads(line)
+                for kind, i in MARKER.findall(record['text']):
+                    if kind == 'mail':
+                        delivered.setdefault(int(i), record['ts'] - start)
+            latencies['mail->signal'] = list(delivered.values())
+        return LoadTestResult(size, process.returncode, wall_seconds, peak_rss_kb, latencies)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='end-to-end load test of signalBot.main')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 10000])
+    parser.add_argument('--directions', nargs='+', choices=['signal', 'mail'], default=['signal', 'mail'])
+    parser.add_argument('--delay', type=float, default=0.0, help='artificial delay per signal-cli call in seconds')
+    parser.add_argument('--env', action='append', default=[], help='extra KEY=VALUE for the bot, e.g. to compare '
+                                                                   'transport modes')
+    parser.add_argument('--timeout', type=float, default=3600)
+    args = parser.parse_args(argv)
+
+    extra_env = dict([e.split('=', 1) for e in args.env])
+    for size in args.sizes:
+        print(run_load_test(size, args.directions, args.delay, extra_env, args.timeout), flush=True)
+
+
+if __name__ == '__main__':
+    main()
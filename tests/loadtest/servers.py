@@ -0,0 +1,178 @@
+"""
+minimal local SMTP sink and scripted IMAP server (both implicit TLS, self-signed) for the load test harness
+"""
+import datetime
+import re
+import socketserver
+import ssl
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Tuple, Dict, Optional
+
+
+def make_self_signed_cert(cert_file: Path, key_file: Path) -> None:
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'localhost')])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key()) \
+        .serial_number(x509.random_serial_number()).not_valid_before(now - datetime.timedelta(days=1)) \
+        .not_valid_after(now + datetime.timedelta(days=1)).sign(key, hashes.SHA256())
+    cert_file.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    key_file.write_bytes(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                           serialization.NoEncryption()))
+
+
+class TLSServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, handler, cert_file: Path, key_file: Path):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.ssl_context.load_cert_chain(cert_file, key_file)
+        self.lock = threading.Lock()
+
+    def get_request(self):
+        sock, address = super().get_request()
+        return self.ssl_context.wrap_socket(sock, server_side=True), address
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> 'TLSServer':
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    def send_line(self, line: str) -> None:
+        self.wfile.write(line.encode('utf-8') + b'\r\n')
+
+    def handle(self):
+        self.send_line('220 localhost ESMTP sink')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command.split(' ')[0].upper()
+            if verb in ['EHLO', 'HELO']:
+                self.send_line('250-localhost')
+                self.send_line('250 AUTH PLAIN LOGIN')
+            elif verb == 'AUTH':
+                if command.upper().startswith('AUTH LOGIN'):
+                    self.send_line('334 VXNlcm5hbWU6')
+                    self.rfile.readline()
+                    self.send_line('334 UGFzc3dvcmQ6')
+                    self.rfile.readline()
+                self.send_line('235 2.7.0 Authentication successful')
+            elif verb == 'DATA':
+                self.send_line('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if data_line in [b'.\r\n', b'.\n', b'']:
+                        break
+                    data.append(data_line[1:] if data_line.startswith(b'..') else data_line)
+                with self.server.lock:
+                    self.server.received.append((time.time(), b''.join(data)))
+                self.send_line('250 OK')
+            elif verb == 'QUIT':
+                self.send_line('221 Bye')
+                return
+            else:
+                self.send_line('250 OK')
+
+
+class SmtpSink(TLSServer):
+    def __init__(self, cert_file: Path, key_file: Path):
+        super().__init__(SmtpHandler, cert_file, key_file)
+        self.received: List[Tuple[float, bytes]] = []
+
+
+@dataclass
+class ImapMail:
+    mail_from: str
+    raw: bytes
+    seen: bool = False
+    headers: bytes = field(init=False)
+
+    def __post_init__(self):
+        self.headers = self.raw.split(b'\r\n\r\n')[0] + b'\r\n\r\n'
+
+
+def parse_uid_set(uid_set: str) -> List[int]:
+    uids = []
+    for part in uid_set.split(','):
+        if ':' in part:
+            start, end = part.split(':')
+            uids += list(range(int(start), int(end) + 1))
+        else:
+            uids.append(int(part))
+    return uids
+
+
+class ImapHandler(socketserver.StreamRequestHandler):
+    def send_line(self, line: str) -> None:
+        self.wfile.write(line.encode('utf-8') + b'\r\n')
+
+    def send_fetch(self, uid: int, item: str, data: bytes) -> None:
+        self.wfile.write(f'* {uid} FETCH (UID {uid} {item} {{{len(data)}}}\r\n'.encode('utf-8') + data + b')\r\n')
+
+    def handle(self):
+        mails: Dict[int, ImapMail] = self.server.mails
+        self.send_line('* OK [CAPABILITY IMAP4rev1 AUTH=PLAIN] scripted IMAP ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, _, command = line.decode('utf-8', 'replace').strip().partition(' ')
+            upper = command.upper()
+            if upper.startswith('CAPABILITY'):
+                self.send_line('* CAPABILITY IMAP4rev1 AUTH=PLAIN')
+            elif upper.startswith('SELECT') or upper.startswith('EXAMINE'):
+                self.send_line(f'* {len(mails)} EXISTS')
+                self.send_line('* 0 RECENT')
+            elif upper.startswith('UID SEARCH'):
+                match = re.search(r'FROM "?([^" ]+)"?', command, re.IGNORECASE)
+                with self.server.lock:
+                    uids = [uid for uid, mail in mails.items() if not mail.seen and
+                            (match is None or match.group(1).lower() in mail.mail_from.lower())]
+                self.send_line('* SEARCH ' + ' '.join([str(uid) for uid in uids]))
+            elif upper.startswith('UID FETCH'):
+                _, _, uid_set, items = command.split(' ', 3)
+                for uid in parse_uid_set(uid_set):
+                    if uid not in mails:
+                        continue
+                    if 'BODY.PEEK[HEADER' in items.upper():
+                        self.send_fetch(uid, f'BODY[HEADER.FIELDS ({items.split("(", 2)[2].split(")")[0]})]',
+                                        mails[uid].headers)
+                    else:
+                        with self.server.lock:
+                            mails[uid].seen = True
+                        self.send_fetch(uid, 'RFC822', mails[uid].raw)
+            elif upper.startswith('UID STORE'):
+                with self.server.lock:
+                    for uid in parse_uid_set(command.split(' ')[2]):
+                        if uid in mails:
+                            mails[uid].seen = True
+            elif upper.startswith('LOGOUT'):
+                self.send_line('* BYE logging out')
+                self.send_line(f'{tag} OK LOGOUT completed')
+                return
+            self.send_line(f'{tag} OK completed')
+
+
+class ImapStandIn(TLSServer):
+    def __init__(self, cert_file: Path, key_file: Path, mails: Optional[List[Tuple[str, bytes]]] = None):
+        super().__init__(ImapHandler, cert_file, key_file)
+        self.mails: Dict[int, ImapMail] = {i + 1: ImapMail(mail_from, raw) for i, (mail_from, raw) in
+                                           enumerate(mails or [])}
@@ -0,0 +1,72 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+
+class TestDedup(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filter_path = Path(self.tmp_dir.name, 'seen_filter.bin')
+        self.env = {'DEDUP_FILTER_PATH': str(self.filter_path), 'SIGNALBOT_ORIGIN_ID': 'bot-1',
+                    'ENCRYPTION_KEY': 'test', 'MESSAGE_INDEX_PATH': str(Path(self.tmp_dir.name, 'index.sqlite3')),
+                    'SIGNAL_ADDRESS_DICT': json.dumps([{'name': 'Person1', 'id': 'uuid-1', 'number': None}])}
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_seen_filter(self):
+        from signalBot.dedupUtil import SeenFilter
+        seen_filter = SeenFilter(self.filter_path, ttl_seconds=100, now=0)
+        self.assertFalse(seen_filter.check_and_add('mail:<a@example.com>', now=0))
+        self.assertTrue(seen_filter.check_and_add('mail:<a@example.com>', now=10))
+        seen_filter.add('signal:uuid-1:1000', now=50)
+        seen_filter.save(now=60)
+        self.assertEqual(self.filter_path.stat().st_size, 32)
+
+        self.assertIn('mail:<a@example.com>', SeenFilter(self.filter_path, ttl_seconds=100, now=90))
+        expired = SeenFilter(self.filter_path, ttl_seconds=100, now=120)
+        self.assertNotIn('mail:<a@example.com>', expired)
+        self.assertIn('signal:uuid-1:1000', expired)
+
+    def test_filter_mail_uids(self):
+        imap_ssl = MagicMock()
+        imap_ssl.uid.return_value = ('OK', [
+            (b'1 (UID 11 BODY[HEADER.FIELDS (MESSAGE-ID X-SIGNALBOT-ORIGIN)] {30}',
+             b'Message-ID: <new@example.com>\r\n\r\n'), b')',
+            (b'2 (UID 12 BODY[HEADER.FIELDS (MESSAGE-ID X-SIGNALBOT-ORIGIN)] {60}',
+             b'Message-ID: <own@example.com>\r\nX-SignalBot-Origin: bot-1\r\n\r\n'), b')',
+            (b'3 (BODY[HEADER.FIELDS (MESSAGE-ID X-SIGNALBOT-ORIGIN)] {30}',
+             b'Message-ID: <old@example.com>\r\n\r\n'), b' UID 13)'])
+        with patch.dict(os.environ, self.env):
+            from signalBot.dedupUtil import get_seen_filter, mail_key
+            from signalBot.mailUtil import filter_mail_uids
+            get_seen_filter().add(mail_key('<old@example.com>'))
+            result = filter_mail_uids(imap_ssl, {'test@example.com': [b'11', b'12', b'13']})
+
+        self.assertEqual(result, {'test@example.com': [b'11']})
+        imap_ssl.uid.assert_called_with('store', b'12,13', '+FLAGS', '(\\Seen)')
+
+    def test_send_mail_origin_header(self):
+        with patch.dict(os.environ, dict(self.env, MAIL_USER='bot@example.com')), \
+                patch('signalBot.mailUtil.smtp_ssl_send', autospec=True) as mock_smtp_ssl_send:
+            from signalBot.dedupUtil import get_seen_filter, mail_key
+            from signalBot.mailUtil import send_mail
+            send_mail('test@example.com', 'body', 'subject')
+            msg = mock_smtp_ssl_send.call_args.kwargs['msg']
+            self.assertEqual(msg['X-SignalBot-Origin'], 'bot-1')
+            self.assertIn(mail_key(msg['Message-ID']), get_seen_filter())
+
+    def test_drop_repeated_envelopes(self):
+        envelope = {'account': '+49666666',
+                    'envelope': {'sourceUuid': 'uuid-1', 'sourceNumber': None, 'timestamp': 1000,
+                                 'dataMessage': {'message': 'hello'}}}
+        response = (json.dumps(envelope) + '\n').encode('utf-8')
+        with patch.dict(os.environ, self.env):
+            from signalBot.signalBot import process_cli_response
+            self.assertEqual(len(process_cli_response(response)['+49666666']), 1)
+            self.assertEqual(dict(process_cli_response(response)), {})
+        # parsing keeps the filter in memory, it is saved by main and after each backlog chunk
+        self.assertFalse(self.filter_path.exists())
@@ -0,0 +1,89 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+
+def make_message(timestamp: int, source: str, uuid: str, text=None, **data_message) -> dict:
+    data_message['message'] = text
+    return {'source': source, 'sourceUuid': uuid, 'sourceNumber': None, 'timestamp': timestamp,
+            'timestamp_str': str(timestamp), 'dataMessage': data_message}
+
+
+class TestDigest(TestCase):
+    def setUp(self) -> None:
+        self.first = make_message(1000, 'Person1', 'uuid-1', 'hello')
+        self.reaction = make_message(2000, 'Person2', 'uuid-2', None,
+                                     reaction={'emoji': '👍', 'targetAuthorUuid': 'uuid-1',
+                                               'targetAuthorNumber': None, 'targetSentTimestamp': 1000})
+        self.answer = make_message(3000, 'Person2', 'uuid-2', 'hi\n\n> [[ quote answer ]]\n> hello',
+                                   quote={'id': 1000, 'authorUuid': 'uuid-1', 'authorNumber': None})
+        self.attachment = {'filename': 'a.jpg', 'id': 'x', 'base64': 'QUJD'}
+        self.with_attachment = make_message(4000, 'Person1', 'uuid-1', 'pic', attachments=[dict(self.attachment)])
+        self.duplicate = make_message(5000, 'Person2', 'uuid-2', 'pic again',
+                                      attachments=[dict(self.attachment, filename='b.jpg')])
+
+    def test_render_digest(self):
+        from signalBot.digestUtil import render_digest
+        subject, body, attachments = render_digest(
+            [self.duplicate, self.reaction, self.first, self.answer, self.with_attachment])
+
+        self.assertIn('5 Nachrichten', subject)
+        self.assertIn('Reaktionen: 👍 Person2', body)
+        self.assertIn('    hi', body)
+        self.assertNotIn('quote answer', body)
+        self.assertIn('[Anhang: b.jpg (identisch mit a.jpg)]', body)
+        self.assertEqual(attachments, [('a.jpg', 'QUJD')])
+        self.assertEqual(body.count('===================='), 4)
+
+    def test_split_digest_batches(self):
+        from signalBot.digestUtil import split_digest_batches
+        batches = split_digest_batches([self.first, self.with_attachment, self.duplicate], max_bytes=12)
+        self.assertEqual([len(b) for b in batches], [2, 1])
+
+    def test_process_signal_msgs_to_digest(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                patch.dict(os.environ, {'MAIL_DIGEST_SPOOL': str(Path(tmp_dir, 'spool.json')),
+                                        'MAIL_DIGEST_INTERVAL': '60',
+                                        'MAIL_ADDRESS_LIST_FORWARD_TO': json.dumps(['a@example.com',
+                                                                                    'b@example.com'])}), \
+                patch('signalBot.digestUtil.send_mail', autospec=True, return_value=True) as mock_send_mail:
+            from signalBot.digestUtil import process_signal_msgs_to_digest
+
+            self.assertEqual(process_signal_msgs_to_digest([self.first], now=0), 0)
+            self.assertEqual(process_signal_msgs_to_digest([self.reaction, self.answer], now=30), 0)
+            mock_send_mail.assert_not_called()
+
+            self.assertEqual(process_signal_msgs_to_digest([], now=61), 2)
+            self.assertEqual(mock_send_mail.call_count, 2)
+            spool = json.loads(Path(tmp_dir, 'spool.json').read_text())
+            self.assertEqual(spool, {'window_start': None, 'messages': [], 'batches': []})
+
+    def test_flush_digest_partial_failure(self):
+        def send_mail_side_effect(mail_address, *args):
+            if mail_address == 'b@example.com' and mock_send_mail.call_count <= 2:
+                raise ConnectionError('smtp down')
+            return True
+
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                patch.dict(os.environ, {'MAIL_DIGEST_SPOOL': str(Path(tmp_dir, 'spool.json')),
+                                        'MAIL_DIGEST_INTERVAL': '60',
+                                        'MAIL_ADDRESS_LIST_FORWARD_TO': json.dumps(['a@example.com',
+                                                                                    'b@example.com'])}), \
+                patch('signalBot.digestUtil.send_mail', autospec=True,
+                      side_effect=send_mail_side_effect) as mock_send_mail:
+            from signalBot.digestUtil import process_signal_msgs_to_digest
+
+            self.assertEqual(process_signal_msgs_to_digest([self.first], now=0), 0)
+            self.assertEqual(process_signal_msgs_to_digest([], now=61), 1)
+            spool = json.loads(Path(tmp_dir, 'spool.json').read_text())
+            self.assertEqual(spool['batches'][0]['recipients'], ['b@example.com'])
+
+            # the retry goes to the failed recipient only
+            self.assertEqual(process_signal_msgs_to_digest([], now=62), 1)
+            self.assertEqual([c.args[0] for c in mock_send_mail.call_args_list],
+                             ['a@example.com', 'b@example.com', 'b@example.com'])
+            spool = json.loads(Path(tmp_dir, 'spool.json').read_text())
+            self.assertEqual(spool['batches'], [])
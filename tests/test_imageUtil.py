@@ -0,0 +1,133 @@
+import email
+import io
+import os
+import tempfile
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from pathlib import Path
+from unittest import TestCase, skipUnless
+from unittest.mock import patch
+
+from signalBot.imageUtil import pil_available
+
+
+class TestImageUtil(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.env = {'IMAGE_TRANSCODE': 'true', 'IMAGE_TRANSCODE_WORKERS': '1',
+                    'IMAGE_TRANSCODE_CACHE': str(Path(self.tmp_dir.name, 'cache'))}
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_transcode_images_cache(self):
+        with patch.dict(os.environ, self.env), \
+                patch('signalBot.imageUtil.transcode_image', autospec=True,
+                      side_effect=lambda data, *args: (data[:2], 'jpg') if data.startswith(b'big') else None) \
+                        as mock_transcode_image:
+            from signalBot.imageUtil import transcode_images, TranscodeReport
+            with patch('signalBot.imageUtil.RUN_REPORT', TranscodeReport()) as run_report:
+                output = transcode_images([b'big-image', b'small', b'big-image'])
+                self.assertEqual(output, [(b'bi', 'jpg'), None, (b'bi', 'jpg')])
+                self.assertEqual(mock_transcode_image.call_count, 2)
+                self.assertEqual(run_report.bytes_saved, 2 * (len(b'big-image') - 2))
+
+                # second run is served from the cache
+                self.assertEqual(transcode_images([b'small', b'big-image']), [None, (b'bi', 'jpg')])
+                self.assertEqual(mock_transcode_image.call_count, 2)
+                self.assertEqual(run_report.cache_hits, 2)
+
+    def test_transcode_mail_attachments(self):
+        with patch.dict(os.environ, self.env), \
+                patch('signalBot.imageUtil.pil_available', autospec=True, return_value=True), \
+                patch('signalBot.imageUtil.transcode_images', autospec=True,
+                      return_value=[(b'small', 'jpg')]) as mock_transcode_images:
+            from signalBot.imageUtil import transcode_mail_attachments
+            result = transcode_mail_attachments([('doc.pdf', b'pdf'), ('photo.HEIC', b'heic')])
+        mock_transcode_images.assert_called_once_with([b'heic'])
+        self.assertEqual(result, [('doc.pdf', b'pdf'), ('photo.jpg', b'small')])
+
+    def test_transcode_images_from_path(self):
+        image_file = Path(self.tmp_dir.name, 'attachment')
+        image_file.write_bytes(b'big-image')
+        with patch.dict(os.environ, self.env), \
+                patch('signalBot.imageUtil.transcode_image', autospec=True,
+                      side_effect=lambda data, *args: (data[:2], 'jpg')) as mock_transcode_image:
+            from signalBot.imageUtil import transcode_images
+            self.assertEqual(transcode_images([image_file]), [(b'bi', 'jpg')])
+            # same content as data is a cache hit
+            self.assertEqual(transcode_images([b'big-image']), [(b'bi', 'jpg')])
+        self.assertEqual(mock_transcode_image.call_count, 1)
+
+    def test_get_image_attachment_files(self):
+        attachment_path = Path(self.tmp_dir.name, 'attachments')
+        attachment_path.mkdir()
+        for attachment_id in ['a', 'b']:
+            Path(attachment_path, attachment_id).write_bytes(b'image')
+
+        def make_envelope(attachment_id: str, group_id: str) -> dict:
+            return {'account': '+49666666',
+                    'envelope': {'dataMessage': {'groupInfo': {'groupId': group_id},
+                                                 'attachments': [{'id': attachment_id, 'filename': 'x.jpg',
+                                                                  'contentType': 'image/jpeg'}]}}}
+
+        with patch.dict(os.environ, dict(self.env, ENCRYPTION_KEY='test', SIGNAL_CONFIG=self.tmp_dir.name,
+                                         SIGNAL_GROUP_ID='group')):
+            from signalBot.signalBot import get_image_attachment_files
+            result = get_image_attachment_files([make_envelope('a', 'group'), make_envelope('b', 'other')])
+        self.assertEqual(result, [('a', Path(attachment_path, 'a'))])
+
+    def test_add_payload_data_size_limit(self):
+        attachment_path = Path(self.tmp_dir.name, 'attachments')
+        attachment_path.mkdir()
+        for attachment_id in ['small', 'big']:
+            Path(attachment_path, attachment_id).write_bytes(b'png')
+        envelope = {'dataMessage': {'attachments': [{'id': 'small', 'filename': 'a.png'},
+                                                    {'id': 'big', 'filename': 'b.png'}]}}
+        transcoded = {'small': (b'x' * 10, 'png'), 'big': (b'x' * 10_000_000, 'png')}
+
+        with patch.dict(os.environ, dict(self.env, ENCRYPTION_KEY='test', SIGNAL_CONFIG=self.tmp_dir.name)):
+            from signalBot.signalBot import add_payload_data
+            envelope = add_payload_data(envelope, transcoded)
+        small, big = envelope['dataMessage']['attachments']
+        self.assertEqual(small['size'], 10)
+        self.assertIsNotNone(small['base64'])
+        self.assertIsNone(big['base64'])
+
+    def test_process_message_heic(self):
+        mail = MIMEMultipart()
+        mail['Subject'] = 'photo'
+        mail['From'] = 'sender@example.com'
+        mail['To'] = 'bot@example.com'
+        mail['Date'] = 'Mon, 01 Jan 2024 12:00:00 +0100'
+        mail.attach(MIMEText('see attachment'))
+        attachment = MIMEApplication(b'heic-data', 'heic')
+        attachment.replace_header('Content-Type', 'image/heic')
+        attachment['Content-Disposition'] = 'attachment; filename="photo.HEIC"'
+        mail.attach(attachment)
+
+        with patch.dict(os.environ, self.env), \
+                patch('signalBot.imageUtil.pil_available', autospec=True, return_value=True), \
+                patch('signalBot.imageUtil.transcode_images', autospec=True,
+                      return_value=[(b'small', 'jpg')]) as mock_transcode_images:
+            from signalBot.imageUtil import transcode_mail_attachments
+            from signalBot.mailUtil import process_message
+            mail_obj = process_message(email.message_from_bytes(mail.as_bytes()))
+            result = transcode_mail_attachments(mail_obj.attachments_list)
+        mock_transcode_images.assert_called_once_with([b'heic-data'])
+        self.assertEqual(result, [('photo.jpg', b'small')])
+
+    @skipUnless(pil_available(), 'Pillow is not installed')
+    def test_transcode_image(self):
+        from PIL import Image
+        from signalBot.imageUtil import transcode_image
+        buffer = io.BytesIO()
+        Image.effect_noise((800, 600), 64).convert('RGB').save(buffer, format='JPEG', quality=100)
+
+        data, ext = transcode_image(buffer.getvalue(), max_bytes=10_000, max_pixels=120_000, quality=70)
+        self.assertEqual(ext, 'jpg')
+        self.assertLess(len(data), len(buffer.getvalue()))
+        with Image.open(io.BytesIO(data)) as img:
+            self.assertLessEqual(img.width * img.height, 120_000)
+        self.assertIsNone(transcode_image(buffer.getvalue(), max_bytes=10 ** 9, max_pixels=10 ** 9, quality=70))
@@ -0,0 +1,12 @@
+from unittest import TestCase
+
+
+class TestLoadTestHarness(TestCase):
+    def test_run_load_test(self):
+        from tests.loadtest.run_load_test import run_load_test
+        result = run_load_test(3, ['signal', 'mail'], timeout=120)
+
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(len(result.latencies['signal->mail']), 3)
+        self.assertEqual(len(result.latencies['mail->signal']), 3)
+        self.assertGreater(result.peak_rss_kb, 0)
@@ -0,0 +1,125 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+
+class TestMessageIndex(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self.tmp_dir.name, 'index.sqlite3')
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_add_lookup(self):
+        from signalBot.messageIndex import MessageIndex
+        index = MessageIndex(self.db_path, cache_size=2)
+        index.add(['uuid-1', '+49111111'], 1000, 'hello', '<a@example.com>')
+        index.add(['uuid-2', None], 2000, 'world', '<b@example.com>')
+        index.commit()
+
+        self.assertEqual(index.lookup([None, '+49111111'], 1000).message_id, '<a@example.com>')
+        self.assertEqual(index.lookup(['uuid-2'], 2000).snippet, 'world')
+        self.assertIsNone(index.lookup(['uuid-1'], 2000))
+        self.assertLessEqual(len(index._cache), 2)
+        index.close()
+
+        # entries survive a restart
+        index = MessageIndex(self.db_path)
+        self.assertEqual(index.lookup(['uuid-1'], 1000).snippet, 'hello')
+        index.close()
+
+    def test_commit_per_batch(self):
+        from signalBot.messageIndex import MessageIndex
+        index = MessageIndex(self.db_path)
+        index.add(['uuid-1'], 1000, 'hello', None)
+        self.assertIsNone(MessageIndex(self.db_path).lookup(['uuid-1'], 1000))
+        index.commit()
+        self.assertEqual(MessageIndex(self.db_path).lookup(['uuid-1'], 1000).snippet, 'hello')
+        index.close()
+
+    def test_compact(self):
+        from signalBot.messageIndex import MessageIndex
+        index = MessageIndex(self.db_path)
+        index.add(['uuid-1'], 1000, 'old', None, now=0)
+        index.add(['uuid-1'], 2000, 'new', None, now=100)
+        self.assertEqual(index.compact(max_age_seconds=50, now=120), 1)
+        self.assertIsNone(index.lookup(['uuid-1'], 1000))
+        self.assertEqual(index.lookup(['uuid-1'], 2000).snippet, 'new')
+        index.close()
+
+    def test_make_snippet(self):
+        from signalBot.messageIndex import make_snippet
+        self.assertEqual(make_snippet('a\n\n  b'), 'a b')
+        self.assertEqual(make_snippet('x' * 200, length=10), 'x' * 9 + '…')
+        self.assertEqual(make_snippet(None), '')
+
+    def test_reaction_with_snippet(self):
+        address_dict = [{'name': 'Person1', 'id': 'uuid-1', 'number': '+49111111'},
+                        {'name': 'Person2', 'id': 'uuid-2', 'number': '+49222222'}]
+        with patch.dict(os.environ, {'ENCRYPTION_KEY': 'test', 'MAIL_USER': 'bot@example.com',
+                                     'MESSAGE_INDEX_PATH': str(self.db_path),
+                                     'SIGNAL_ADDRESS_DICT': json.dumps(address_dict)}):
+            from signalBot.signalBot import add_message_id, add_emoji_reaction, add_to_message_index, \
+                get_mail_headers
+            message = add_message_id({'sourceUuid': 'uuid-1', 'sourceNumber': '+49111111', 'timestamp': 1000,
+                                      'dataMessage': {'message': 'see you at the station'}})
+            add_to_message_index(message, message['messageId'])
+            reaction = add_message_id({'sourceUuid': 'uuid-2', 'sourceNumber': '+49222222', 'timestamp': 2000,
+                                       'dataMessage': {'reaction': {'emoji': '👍', 'targetAuthorUuid': 'uuid-1',
+                                                                    'targetAuthorNumber': '+49111111',
+                                                                    'targetSentTimestamp': 1000}}})
+            reaction = add_emoji_reaction(reaction)
+
+        self.assertIn('to message: see you at the station', reaction['dataMessage']['message'])
+        self.assertTrue(message['messageId'].endswith('@example.com>'))
+        self.assertEqual(get_mail_headers(reaction)['In-Reply-To'], message['messageId'])
+
+    def test_index_forwarded_messages_only(self):
+        def make_envelope(ts: int, group_id: str) -> dict:
+            return {'source': 'Person1', 'sourceUuid': 'uuid-1', 'sourceNumber': None, 'timestamp': ts,
+                    'timestamp_str': str(ts), 'messageId': f'<{ts}@example.com>',
+                    'dataMessage': {'message': f'msg {ts}', 'groupInfo': {'groupId': group_id}}}
+
+        messages = {'+49666666': [make_envelope(1000, 'group'), make_envelope(2000, 'other'),
+                                  make_envelope(3000, 'group')]}
+        with patch.dict(os.environ, {'ENCRYPTION_KEY': 'test', 'MESSAGE_INDEX_PATH': str(self.db_path),
+                                     'SIGNAL_GROUP_ID': 'group', 'MAIL_DIGEST_MODE': 'false',
+                                     'MAIL_ADDRESS_LIST_FORWARD_TO': json.dumps(['a@example.com'])}), \
+                patch('signalBot.signalBot.send_mail', autospec=True,
+                      side_effect=[True, ConnectionError('smtp down')]):
+            from signalBot.signalBot import process_signal_msgs_to_mail
+            self.assertEqual(process_signal_msgs_to_mail(messages), 1)
+
+        from signalBot.messageIndex import MessageIndex
+        index = MessageIndex(self.db_path)
+        self.assertEqual(index.lookup(['uuid-1'], 1000).message_id, '<1000@example.com>')
+        self.assertIsNone(index.lookup(['uuid-1'], 2000))
+        self.assertIsNone(index.lookup(['uuid-1'], 3000))
+        index.close()
+
+    def test_no_reply_header_for_unsent_message(self):
+        def make_envelope(ts: int, in_reply_to=None) -> dict:
+            envelope = {'source': 'Person1', 'sourceUuid': 'uuid-1', 'sourceNumber': None, 'timestamp': ts,
+                        'timestamp_str': str(ts), 'messageId': f'<{ts}@example.com>',
+                        'dataMessage': {'message': f'msg {ts}', 'groupInfo': {'groupId': 'group'}}}
+            if in_reply_to is not None:
+                envelope['inReplyTo'] = in_reply_to
+            return envelope
+
+        messages = {'+49666666': [make_envelope(1000), make_envelope(2000, in_reply_to='<1000@example.com>'),
+                                  make_envelope(3000, in_reply_to='<2000@example.com>')]}
+        with patch.dict(os.environ, {'ENCRYPTION_KEY': 'test', 'MESSAGE_INDEX_PATH': str(self.db_path),
+                                     'SIGNAL_GROUP_ID': 'group', 'MAIL_DIGEST_MODE': 'false',
+                                     'MAIL_ADDRESS_LIST_FORWARD_TO': json.dumps(['a@example.com'])}), \
+                patch('signalBot.signalBot.send_mail', autospec=True,
+                      side_effect=[ConnectionError('smtp down'), True, True]) as mock_send_mail:
+            from signalBot.signalBot import process_signal_msgs_to_mail
+            self.assertEqual(process_signal_msgs_to_mail(messages), 2)
+
+        headers = [c.args[4] for c in mock_send_mail.call_args_list]
+        self.assertNotIn('In-Reply-To', headers[1])
+        self.assertEqual(headers[2]['In-Reply-To'], '<2000@example.com>')
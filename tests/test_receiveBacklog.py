@@ -0,0 +1,90 @@
+import json
+import os
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+
+def make_cli_output(timestamps: list, group_id: str = 'group') -> bytes:
+    lines = [json.dumps({'account': '+49666666',
+                         'envelope': {'source': '+49111111', 'sourceNumber': '+49111111', 'sourceUuid': 'uuid-1',
+                                      'timestamp': ts, 'dataMessage': {'timestamp': ts, 'message': f'msg {ts}',
+                                                                       'groupInfo': {'groupId': group_id}}}})
+             for ts in timestamps]
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def forward_all(messages: dict) -> int:
+    for message in messages.get('+49666666', []):
+        message['forwarded'] = True
+    return len(messages.get('+49666666', []))
+
+
+class TestReceiveBacklog(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.checkpoint_path = Path(self.tmp_dir.name, 'checkpoint.json')
+        self.env = {'ENCRYPTION_KEY': 'test',
+                    'SIGNAL_ADDRESS_DICT': json.dumps([{'name': 'Person1', 'id': 'uuid-1', 'number': '+49111111'}]),
+                    'MESSAGE_INDEX_PATH': str(Path(self.tmp_dir.name, 'index.sqlite3')),
+                    'SIGNAL_RECEIVE_CHECKPOINT': str(self.checkpoint_path),
+                    'DEDUP_FILTER_PATH': str(Path(self.tmp_dir.name, 'seen_filter.bin')),
+                    'SIGNAL_RECEIVE_MAX_MESSAGES': '2',
+                    'SIGNAL_GROUP_ID': 'group',
+                    'MAIL_DIGEST_MODE': 'false',
+                    'MAIL_ADDRESS_LIST_FORWARD_TO': json.dumps(['a@example.com'])}
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def run_backlog(self, chunks: list, env: dict, process_chunk=forward_all, clock=time.monotonic):
+        responses = [subprocess.CompletedProcess([], 0, c if isinstance(c, bytes) else make_cli_output(c), b'')
+                     for c in chunks]
+        processed = []
+        with patch.dict(os.environ, env), \
+                patch('signalBot.signalBot.run_signal_cli_command', autospec=True,
+                      side_effect=responses) as mock_run_signal_cli_command:
+            from signalBot.signalBot import receive_messages_backlog
+            result = receive_messages_backlog('+49666666', 'signal-cli', 'config',
+                                              process_chunk=lambda m: processed.append(m) or process_chunk(m),
+                                              clock=clock)
+        return result, processed, mock_run_signal_cli_command
+
+    def test_drain_in_chunks(self):
+        (received, sent), processed, mock_run = self.run_backlog([[1000, 2000], [3000, 4000], [5000]], self.env)
+
+        self.assertEqual((received, sent), (5, 5))
+        self.assertEqual(len(processed), 3)
+        self.assertIn('--max-messages', mock_run.call_args.args[0])
+        self.assertEqual(json.loads(self.checkpoint_path.read_text()), {'+49666666': 5000})
+
+    def test_time_budget(self):
+        clock = iter([0, 0, 5])
+        (received, sent), processed, mock_run = self.run_backlog(
+            [[1000, 2000], [3000, 4000]], dict(self.env, SIGNAL_RECEIVE_TIME_BUDGET='4'), clock=lambda: next(clock))
+
+        self.assertEqual((received, sent), (2, 2))
+        self.assertEqual(mock_run.call_count, 1)
+        self.assertEqual(json.loads(self.checkpoint_path.read_text()), {'+49666666': 2000})
+
+    def test_checkpoint_only_forwarded(self):
+        with patch.dict(os.environ, self.env):
+            from signalBot.signalBot import process_signal_msgs_to_mail
+        with patch('signalBot.signalBot.send_mail', autospec=True, side_effect=ConnectionError('smtp down')):
+            (received, sent), processed, mock_run = self.run_backlog(
+                [make_cli_output([1000]) + make_cli_output([2000], group_id='other'), []], self.env,
+                process_chunk=process_signal_msgs_to_mail)
+
+        self.assertEqual((received, sent), (2, 0))
+        self.assertFalse(self.checkpoint_path.exists() and json.loads(self.checkpoint_path.read_text()))
+
+    def test_skip_checkpointed(self):
+        self.checkpoint_path.write_text(json.dumps({'+49666666': 2000}))
+        (received, sent), processed, mock_run = self.run_backlog([[1000, 2000], [3000]], self.env)
+
+        self.assertEqual((received, sent), (3, 1))
+        self.assertEqual([m['timestamp'] for m in processed[1]['+49666666']], [3000])
+        self.assertEqual(json.loads(self.checkpoint_path.read_text()), {'+49666666': 3000})
@@ -0,0 +1,81 @@
+import gzip
+import json
+import subprocess
+import os
+import tempfile
+from email.mime.text import MIMEText
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+
+class TestCaptureReplay(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.env = {'CAPTURE_DIR': str(Path(self.tmp_dir.name, 'capture')), 'ENCRYPTION_KEY': 'test',
+                    'MAIL_ADDRESS_LIST_FORWARD_TO': json.dumps(['a@example.com', 'b@example.com']),
+                    'SIGNAL_GROUP_ID': 'group-1', 'SIGNAL_NUMBER': '+49666666',
+                    'SIGNAL_ADDRESS_DICT': json.dumps([{'name': 'Person1', 'id': 'uuid-1', 'number': None}])}
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_capture_replay(self):
+        envelopes = [{'account': '+49666666',
+                      'envelope': {'sourceUuid': 'uuid-1', 'sourceNumber': None, 'timestamp': ts,
+                                   'dataMessage': {'message': f'msg {ts}', 'groupInfo': {'groupId': 'group-1'},
+                                                   'attachments': [{'id': f'att{ts}', 'filename': None}]}}}
+                     for ts in [1000, 2000]]
+        response = '\n'.join([json.dumps(e) for e in envelopes]).encode('utf-8')
+        mail = MIMEText('hello group')
+        mail['Subject'] = 'test'
+        mail['From'] = 'test@example.com'
+        mail['To'] = 'bot@example.com'
+        mail['Date'] = 'Mon, 03 Jul 2023 10:00:00 +0200'
+
+        with patch.dict(os.environ, self.env), patch('signalBot.captureUtil._CAPTURE_FILE', None), \
+                patch('signalBot.captureUtil._CAPTURE_HANDLE', None):
+            from signalBot.captureUtil import capture_signal_receive, capture_imap_messages, get_capture_file, \
+                read_capture_file, close_capture
+            capture_signal_receive(response, 0, 0.5)
+            capture_imap_messages('test@example.com', [mail.as_bytes()], 0.1)
+            close_capture()
+            records = list(read_capture_file(get_capture_file()))
+
+        self.assertEqual([r['kind'] for r in records], ['signal_receive', 'imap'])
+        self.assertEqual(records[0]['data'], response.decode('utf-8'))
+
+        with patch.dict(os.environ, self.env):
+            from signalBot.replay import replay
+            stats = replay(records)
+        self.assertEqual(stats.records, {'signal_receive': 1, 'imap': 1})
+        self.assertEqual(stats.mails_sent, 4)
+        self.assertEqual(stats.signal_sends, 1)
+
+    def test_read_unclosed_capture(self):
+        with patch.dict(os.environ, self.env), patch('signalBot.captureUtil._CAPTURE_FILE', None), \
+                patch('signalBot.captureUtil._CAPTURE_HANDLE', None):
+            from signalBot.captureUtil import write_capture_record, get_capture_file, read_capture_file, close_capture
+            write_capture_record({'kind': 'imap', 'data': 'first'})
+            write_capture_record({'kind': 'imap', 'data': 'second'})
+            # copy of the archive as an interrupted run leaves it: flushed, but without the gzip trailer
+            unclosed_file = Path(self.tmp_dir.name, 'unclosed.ndjson.gz')
+            unclosed_file.write_bytes(get_capture_file().read_bytes())
+            close_capture()
+
+            with self.assertRaises(EOFError):
+                with gzip.open(unclosed_file, 'rt', encoding='utf-8') as capture_file:
+                    capture_file.read()
+            self.assertEqual([r['data'] for r in read_capture_file(unclosed_file)], ['first', 'second'])
+
+    def test_capture_error_does_not_stop_receive(self):
+        # a regular file as CAPTURE_DIR cannot be created as a directory
+        capture_dir = Path(self.tmp_dir.name, 'not_a_dir')
+        capture_dir.write_text('')
+        response = subprocess.CompletedProcess([], 0, b'{"envelope": {}}\n', b'')
+        with patch.dict(os.environ, dict(self.env, CAPTURE_DIR=str(capture_dir))), \
+                patch('signalBot.captureUtil._CAPTURE_FILE', None), \
+                patch('signalBot.captureUtil._CAPTURE_HANDLE', None), \
+                patch('signalBot.signalBot.run_signal_cli_command', autospec=True, return_value=response):
+            from signalBot.signalBot import run_signal_cli_receive
+            self.assertIs(run_signal_cli_receive('+49666666', 'signal-cli', 'config'), response)
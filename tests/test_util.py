@@ -0,0 +1,51 @@
+import os
+import re
+import subprocess
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from signalBot.util import split_message_text, cmd_send_to_group, cmd_add_attachment
+
+
+class TestUtil(TestCase):
+    def test_split_message_text_short(self):
+        self.assertEqual(split_message_text('hello\n\nworld', 100), ['hello\n\nworld'])
+
+    def test_split_message_text_paragraphs(self):
+        paragraphs = [f'paragraph {i} ' + 'x' * 40 for i in range(20)]
+        text = '\n\n'.join(paragraphs)
+        parts = split_message_text(text, 200)
+
+        self.assertGreater(len(parts), 1)
+        self.assertTrue(all([len(part) <= 200 for part in parts]))
+        self.assertTrue(parts[0].startswith(f'[1/{len(parts)}]\n'))
+        self.assertEqual('\n\n'.join([re.sub(r'^\[\d+/\d+\]\n', '', part) for part in parts]), text)
+
+    def test_split_message_text_long_lines(self):
+        text = 'a' * 500 + '\n' + 'b' * 50
+        parts = split_message_text(text, 100)
+        self.assertTrue(all([len(part) <= 100 for part in parts]))
+        self.assertEqual(''.join([re.sub(r'^\[\d+/\d+\]\n', '', part) for part in parts]).replace('\n', ''),
+                         text.replace('\n', ''))
+
+    def test_cmd_send_to_group_stdin(self):
+        cmd = cmd_send_to_group("it's $5", 'group-1', base_cmd=['send'], message_from_stdin=True,
+                                attachment_cmd=cmd_add_attachment(Path('/tmp/a.jpg')))
+        self.assertEqual(cmd, ['send', '-g', 'group-1', '--message-from-stdin', '-a', '/tmp/a.jpg'])
+
+    def test_send_message_group_id_stdin(self):
+        text = '\n\n'.join(['y' * 60] * 10)
+        with patch.dict(os.environ, {'ENCRYPTION_KEY': 'test', 'SIGNAL_MESSAGE_FROM_STDIN': 'true',
+                                     'SIGNAL_MESSAGE_MAX_LENGTH': '200', 'SIGNAL_NUMBER': '+49666666',
+                                     'SIGNAL_CLI': 'signal-cli', 'SIGNAL_CONFIG': 'config'}), \
+                patch('signalBot.util.subprocess.run', autospec=True,
+                      return_value=subprocess.CompletedProcess([], 0, b'', b'')) as mock_run:
+            from signalBot.signalBot import send_message_group_id
+            send_message_group_id('group-1', text, attachment=Path('/tmp/a.jpg'))
+
+        inputs = [c.kwargs['input'].decode('utf-8') for c in mock_run.call_args_list]
+        self.assertEqual(len(inputs), 4)
+        self.assertTrue(inputs[-1].startswith('[4/4]\n'))
+        self.assertTrue(all(['-m' not in c.args[0] for c in mock_run.call_args_list]))
+        self.assertEqual(['/tmp/a.jpg' in c.args[0] for c in mock_run.call_args_list], [False, False, False, True])